@@ -0,0 +1,93 @@
+from path_buffer import PathBuffer
+from point import Point, Tool
+
+
+class Backend:
+    # What Gerber does with the paths and drill hits it reads. Locations are in counts
+    # with the tool offsets applied. Every method does nothing here, so a backend only
+    # overrides the calls it cares about.
+    def plot_path(self, tool: Tool, path: PathBuffer) -> None:
+        pass
+
+    def plot_drill(self, location: Point) -> None:
+        pass
+
+    def end_pattern(self) -> None:
+        # Called at each N command, before the new pattern starts.
+        pass
+
+    def finish(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        # Called instead of finish when the conversion fails.
+        pass
+
+
+class NullSink(Backend):
+    # Throws everything away, for measuring the cost of reading and interpreting a
+    # file on its own.
+    pass
+
+
+class Recorder(Backend):
+    # Keeps every call in memory so they can be inspected or replayed to another
+    # backend. Each call is the method name followed by its arguments.
+    calls: list[tuple]
+    finished: bool
+    aborted: bool
+
+    def __init__(self):
+        self.calls = []
+        self.finished = False
+        self.aborted = False
+
+    def plot_path(self, tool: Tool, path: PathBuffer) -> None:
+        self.calls.append(("plot_path", tool, path))
+
+    def plot_drill(self, location: Point) -> None:
+        self.calls.append(("plot_drill", location))
+
+    def end_pattern(self) -> None:
+        self.calls.append(("end_pattern",))
+
+    def finish(self) -> None:
+        self.finished = True
+
+    def abort(self) -> None:
+        self.aborted = True
+
+    def replay(self, backend: Backend) -> None:
+        # Make the recorded calls on backend and finish it.
+        for name, *arguments in self.calls:
+            getattr(backend, name)(*arguments)
+        backend.finish()
+
+
+class FanOut(Backend):
+    # Passes every call on to several backends, so one pass over a file can produce
+    # several outputs.
+    backends: list[Backend]
+
+    def __init__(self, backends: list[Backend]):
+        self.backends = backends
+
+    def plot_path(self, tool: Tool, path: PathBuffer) -> None:
+        for backend in self.backends:
+            backend.plot_path(tool, path)
+
+    def plot_drill(self, location: Point) -> None:
+        for backend in self.backends:
+            backend.plot_drill(location)
+
+    def end_pattern(self) -> None:
+        for backend in self.backends:
+            backend.end_pattern()
+
+    def finish(self) -> None:
+        for backend in self.backends:
+            backend.finish()
+
+    def abort(self) -> None:
+        for backend in self.backends:
+            backend.abort()
@@ -0,0 +1,70 @@
+import queue
+import threading
+from typing import IO, AnyStr, Generic
+
+# Size of each of the two buffers, in characters or bytes.
+DEFAULT_BUFFER_SIZE = 1 << 22
+
+
+class BackgroundWriter(Generic[AnyStr]):
+    # Writes to a file from a background thread. Writes are collected in a buffer and
+    # when it's full it's handed to the thread and a new one is started, so one buffer
+    # fills while the other is written. The queue holds one buffer, so at most two
+    # are in memory and a slow disk makes the writer wait rather than grow.
+    file: IO[AnyStr]
+    buffer_size: int
+    buffer: list[AnyStr]
+    buffered: int
+    buffers: queue.Queue
+    thread: threading.Thread
+    error: OSError | ValueError | None
+
+    def __init__(self, file: IO[AnyStr], buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.file = file
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.buffers = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self.write_buffers, daemon=True)
+        self.thread.start()
+
+    def write_buffers(self) -> None:
+        # Runs in the background thread until close sends None.
+        while (buffer := self.buffers.get()) is not None:
+            if self.error is None:
+                try:
+                    self.file.write(buffer[0][:0].join(buffer))
+                except (OSError, ValueError) as e:
+                    # Raised to the caller by the next write or close, e.g. a full
+                    # disk or an encoding error.
+                    self.error = e
+
+    def check_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data: AnyStr) -> int:
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        # Hand the buffer to the background thread.
+        self.check_error()
+        if self.buffer:
+            self.buffers.put(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self) -> None:
+        # Write what's left, wait for the thread and close the file.
+        try:
+            self.flush()
+        finally:
+            self.buffers.put(None)
+            self.thread.join()
+            self.file.close()
+        self.check_error()
@@ -0,0 +1,141 @@
+import dataclasses
+import functools
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, TypeVar
+
+from conversion_cache import ConversionCache
+from converter import ConversionOptions, convert_file
+from gerber import GerberDataError
+from run_stats import RunStats
+
+# Extensions of the files picked up when a directory is given.
+GERBER_EXTENSIONS = (".gbr", ".ger")
+
+# Errors from a file that can't be read or converted, which fail only that file in a
+# batch. ValueError includes text that isn't UTF-8 and EOFError a truncated toolpath.
+FILE_ERRORS = (OSError, EOFError, ValueError, GerberDataError, NotImplementedError)
+
+T = TypeVar("T")
+
+
+@dataclass
+class ConversionResult:
+    file_name: str
+    output_names: list[str] | None
+    error: str | None
+    seconds: float
+    # Whether the output came from the cache, or None without a cache.
+    cached: bool | None = None
+
+
+def expand_inputs(inputs: Iterable[str]) -> tuple[list[str], list[str]]:
+    # Expand files, directories and glob patterns into a list of files, without
+    # duplicates and in the order given. Also returns the inputs that matched no
+    # files, such as a mistyped file name.
+    file_names = []
+    unmatched = []
+    for name in inputs:
+        count = len(file_names)
+        if os.path.isdir(name):
+            file_names += sorted(
+                os.path.join(name, entry)
+                for entry in os.listdir(name)
+                if entry.lower().endswith(GERBER_EXTENSIONS)
+            )
+        elif os.path.exists(name):
+            file_names.append(name)
+        else:
+            file_names += sorted(glob.glob(name, recursive=True))
+        if len(file_names) == count:
+            unmatched.append(name)
+    return list(dict.fromkeys(file_names)), unmatched
+
+
+def worker_count(workers: int | None, file_count: int) -> int:
+    # The number of worker processes for a batch: as many as asked for or one per
+    # CPU, but no more than there are files.
+    return min(workers or os.cpu_count() or 1, max(file_count, 1))
+
+
+def run_batch(
+    worker: Callable[[str], T], file_names: list[str], workers: int
+) -> Iterable[T]:
+    # Run worker on each file in a pool of worker processes and yield the results in
+    # the order the files were given. worker has to be picklable, such as a
+    # functools.partial of a module-level function. With one worker, the files are
+    # run in this process.
+    if workers == 1:
+        yield from map(worker, file_names)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(worker, file_names)
+
+
+def run_one(worker: Callable[[str], T], file_name: str) -> tuple[T | None, str | None]:
+    # Run worker on a file and return its result and None, or None and the error if
+    # the file failed, rather than raising it so one bad file doesn't stop the batch.
+    try:
+        return worker(file_name), None
+    except FILE_ERRORS as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def convert_one(
+    file_name: str,
+    options: ConversionOptions,
+    cache: ConversionCache | None = None,
+    stats: RunStats | None = None,
+) -> ConversionResult:
+    # Convert a file, reporting a failure in the result. See run_one.
+    start = time.perf_counter()
+    hits = cache.hits if cache is not None else 0
+    output_names, error = run_one(
+        functools.partial(convert_file, options=options, cache=cache, stats=stats),
+        file_name,
+    )
+    return ConversionResult(
+        file_name,
+        output_names,
+        error,
+        time.perf_counter() - start,
+        cache.hits > hits if cache is not None else None,
+    )
+
+
+def convert_batch(
+    file_names: list[str],
+    options: ConversionOptions,
+    workers: int | None = None,
+    cache: ConversionCache | None = None,
+    stats: RunStats | None = None,
+) -> Iterable[ConversionResult]:
+    # Convert files in a pool of worker processes, one Gerber/Igor pair per file.
+    # Results are yielded in the order the files were given. Each worker already has
+    # a file to itself, so files are tokenized in a single process. With stats, the
+    # files are converted in this process so their work can be added to stats.
+    options = dataclasses.replace(options, jobs=1)
+    workers = 1 if stats is not None else worker_count(workers, len(file_names))
+    convert = functools.partial(convert_one, options=options, cache=cache, stats=stats)
+    for result in run_batch(convert, file_names, workers):
+        # Workers count hits and misses in their own copy of the cache.
+        if workers > 1 and result.cached is not None:
+            cache.count(result.cached)
+        yield result
+
+
+def print_summary(results: list[ConversionResult], elapsed: float) -> None:
+    failures = [result for result in results if result.error is not None]
+    for result in failures:
+        print(f"FAILED {result.file_name}: {result.error}")
+    print(
+        f"Converted {len(results) - len(failures)} of {len(results)} files"
+        f" in {elapsed:.2f}s ({len(failures)} failed)."
+    )
+    cached = [result for result in results if result.cached]
+    if cached:
+        print(f"{len(cached)} files were copied from the cache.")
@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Callable
+
+from backend import Backend, NullSink, Recorder
+from converter import ConversionOptions, create_gerber, create_output, run_gerber
+from generate_gerber import WORKLOADS, generate
+from gerber_token import TokenBatch
+from tokenizer import stream_batches
+
+DEFAULT_RESULTS_FILE = "benchmark_results.json"
+
+STAGES = ["tokenize", "interpret", "output", "total"]
+
+
+@dataclass
+class StageResult:
+    seconds: float
+    tokens_per_second: float
+    megabytes_per_second: float
+    peak_megabytes: float
+
+
+def tokenize(file_name: str) -> list[TokenBatch]:
+    with open(file_name, "r") as gerber_file:
+        return list(stream_batches(gerber_file))
+
+
+def interpret(file_name: str, batches: list[TokenBatch], backend: Backend) -> None:
+    # Every pattern is interpreted, so the stages all cover the whole file.
+    gerber = create_gerber(ConversionOptions(), backend, through_stops=True)
+    for batch in batches:
+        gerber.command_batch(batch)
+    gerber.finish()
+
+
+def measure(run: Callable[[], object], repeat: int) -> tuple[float, float]:
+    # Return the best time of repeat runs and the peak memory of one more run, which
+    # is measured separately because tracing memory slows everything down.
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def benchmark_file(
+    file_name: str, options: ConversionOptions, repeat: int
+) -> dict[str, StageResult]:
+    # Time tokenizing, interpreting and writing the output of a file separately and
+    # then all together, reading through every M0. Interpreting uses tokens
+    # tokenized in advance and writes nothing, and writing replays what interpreting
+    # produced.
+    size = os.path.getsize(file_name)
+    batches = tokenize(file_name)
+    tokens = sum(map(len, batches))
+    recorder = Recorder()
+    interpret(file_name, batches, recorder)
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_basename = os.path.join(directory, "benchmark")
+
+        def output():
+            recorder.replay(create_output(output_basename, options))
+
+        def total():
+            gerber = create_gerber(
+                options,
+                create_output(output_basename, options),
+                through_stops=True,
+            )
+            run_gerber(gerber, file_name, options.jobs, options.pipeline)
+            gerber.finish()
+
+        runs = {
+            "tokenize": lambda: tokenize(file_name),
+            "interpret": lambda: interpret(file_name, batches, NullSink()),
+            "output": output,
+            "total": total,
+        }
+        results = {}
+        for stage in STAGES:
+            seconds, peak = measure(runs[stage], repeat)
+            results[stage] = StageResult(
+                seconds, tokens / seconds, size / 1e6 / seconds, peak / 1e6
+            )
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(file_name: str) -> list[dict]:
+    try:
+        with open(file_name, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def previous_result(
+    results: list[dict], workload: str, output_format: str
+) -> dict | None:
+    for result in reversed(results):
+        if result["workload"] == workload and result["format"] == output_format:
+            return result
+    return None
+
+
+def print_results(
+    workload: str, stages: dict[str, StageResult], previous: dict | None
+) -> None:
+    print(workload)
+    for stage, result in stages.items():
+        line = (
+            f"  {stage:<10}{result.seconds:>9.3f}s"
+            f"{result.tokens_per_second:>14,.0f} tokens/s"
+            f"{result.megabytes_per_second:>8.2f} MB/s"
+            f"{result.peak_megabytes:>9.1f} MB peak"
+        )
+        if previous is not None and stage in previous["stages"]:
+            before = previous["stages"][stage]["seconds"]
+            line += f"{100 * (result.seconds - before) / before:>+8.1f}%"
+        print(line)
+    if previous is not None:
+        print(f"  (change in time since {previous['commit']} at {previous['time']})")
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Time the tokenizer, interpreter and Igor output separately and together."
+    )
+    parser.add_argument(
+        "gerberfile",
+        help="Gerber files to benchmark. (Default: the generated small and medium workloads)",
+        nargs="*",
+    )
+    parser.add_argument(
+        "-w",
+        "--workload",
+        help="Generated workloads to benchmark.",
+        choices=list(WORKLOADS),
+        action="append",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output format for the output and total stages. (Default itx)",
+        default="itx",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        help="Runs of each stage. The best time is reported. (Default 3)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--results",
+        help=f"File the results are added to and compared with. (Default {DEFAULT_RESULTS_FILE})",
+        default=DEFAULT_RESULTS_FILE,
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    options = ConversionOptions(format=args.format)
+    results = load_results(args.results)
+    commit = git_commit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = [(os.path.basename(name), name) for name in args.gerberfile]
+        workloads = args.workload or ([] if inputs else ["small", "medium"])
+        for workload in workloads:
+            file_name = os.path.join(directory, workload + ".gbr")
+            with open(file_name, "w") as f:
+                generate(f, WORKLOADS[workload])
+            inputs.append((workload, file_name))
+
+        for workload, file_name in inputs:
+            stages = benchmark_file(file_name, options, args.repeat)
+            previous = previous_result(results, workload, args.format)
+            print_results(workload, stages, previous)
+            results.append(
+                {
+                    "time": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "commit": commit,
+                    "workload": workload,
+                    "format": args.format,
+                    "bytes": os.path.getsize(file_name),
+                    "stages": {
+                        stage: asdict(result) for stage, result in stages.items()
+                    },
+                }
+            )
+
+    with open(args.results, "w") as f:
+        json.dump(results, f, indent=2)
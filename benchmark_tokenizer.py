@@ -0,0 +1,77 @@
+import argparse
+import os
+import tempfile
+import time
+
+from tokenizer import parallel_batches, stream_batches
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Measure tokenizer throughput against the number of workers."
+    )
+    parser.add_argument("gerberfile", help="Gerber file to tokenize.")
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        help="Repeat the file contents this many times to make a larger input. (Default 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Worker counts to measure. (Default 1, 2, 4, ... up to the number of CPUs)",
+        type=int,
+        nargs="+",
+    )
+    return parser
+
+
+def default_worker_counts() -> list[int]:
+    cpu_count = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpu_count:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpu_count:
+        counts.append(cpu_count)
+    return counts
+
+
+def time_stream(file_name: str) -> tuple[int, float]:
+    start = time.perf_counter()
+    with open(file_name, "r") as gerber_file:
+        count = sum(map(len, stream_batches(gerber_file)))
+    return count, time.perf_counter() - start
+
+
+def time_parallel(file_name: str, workers: int) -> tuple[int, float]:
+    start = time.perf_counter()
+    count = sum(map(len, parallel_batches(file_name, workers)))
+    return count, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+
+    with open(args.gerberfile, "rb") as f:
+        contents = f.read()
+
+    with tempfile.NamedTemporaryFile(suffix=".gbr", delete=False) as f:
+        for _ in range(args.repeat):
+            f.write(contents)
+        input_name = f.name
+
+    try:
+        size = os.path.getsize(input_name)
+        print(f"Input: {size / 1e6:.1f} MB")
+
+        count, elapsed = time_stream(input_name)
+        print(f"stream      {count:>12} tokens {count / elapsed:>14,.0f} tokens/s")
+        for workers in args.workers or default_worker_counts():
+            count, elapsed = time_parallel(input_name, workers)
+            print(
+                f"{workers:>3} workers {count:>12} tokens {count / elapsed:>14,.0f} tokens/s"
+            )
+    finally:
+        os.remove(input_name)
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+DEFAULT_MAX_BYTES = 1 << 30
+DEFAULT_MAX_AGE_DAYS = 30
+
+STATS_FILE_NAME = "stats.json"
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class ConversionCache:
+    # Stores conversion outputs on disk keyed by a hash of the input file and the
+    # settings that affect the output, so unchanged files aren't converted again.
+    # Hits and misses are counted once per converted file, in memory, and added to
+    # the totals on disk by save_stats.
+    directory: str
+    max_bytes: int
+    max_age_days: float
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file_name: str, settings: dict) -> str:
+        # Hash the input file together with the settings that affect the output.
+        digest = hashlib.sha256()
+        with open(file_name, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key: str, suffix: str) -> str:
+        # suffix tells apart the outputs of one conversion: the output's name after
+        # the input's basename, like ".itx" or "_lod2.itx".
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def fetch(self, key: str, suffix: str, output_name: str) -> bool:
+        # Copy a cached output to output_name. Return false if there isn't one.
+        entry = self.entry_path(key, suffix)
+        try:
+            shutil.copyfile(entry, output_name)
+        except FileNotFoundError:
+            return False
+
+        # The modification time is the last use, which is what eviction goes by.
+        os.utime(entry)
+        return True
+
+    def count(self, hit: bool) -> None:
+        # Count a file whose outputs were all fetched, or that had to be converted.
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def store(self, key: str, suffix: str, output_name: str) -> None:
+        entry = self.entry_path(key, suffix)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # Copy to a temporary file first so other processes never see a partial entry.
+        handle, temporary_name = tempfile.mkstemp(dir=os.path.dirname(entry))
+        os.close(handle)
+        shutil.copyfile(output_name, temporary_name)
+        os.replace(temporary_name, entry)
+
+    def entries(self) -> list[os.DirEntry]:
+        entries = []
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                entries += [entry for entry in os.scandir(shard) if entry.is_file()]
+        return entries
+
+    def entry_stats(self) -> list[tuple[float, int, str]]:
+        # The modification time, size and path of each entry. Entries another run
+        # removes while they are listed are left out.
+        stats = []
+        for entry in self.entries():
+            try:
+                status = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats.append((status.st_mtime, status.st_size, entry.path))
+        return stats
+
+    def evict(self) -> None:
+        # Remove entries that haven't been used for max_age_days, then the least
+        # recently used entries until the cache fits in max_bytes. Another run may
+        # be evicting at the same time, so entries can already be gone.
+        oldest_allowed = time.time() - self.max_age_days * 24 * 60 * 60
+        entries = sorted(self.entry_stats())
+        total = sum(size for _, size, _ in entries)
+        for modified, size, path in entries:
+            if modified >= oldest_allowed and total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.evictions += 1
+
+    def stats_path(self) -> str:
+        return os.path.join(self.directory, STATS_FILE_NAME)
+
+    def load_stats(self) -> dict:
+        try:
+            with open(self.stats_path(), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"hits": 0, "misses": 0, "evictions": 0}
+
+    def save_stats(self) -> dict:
+        # Add this run's counts to the totals on disk and return the new totals.
+        stats = self.load_stats()
+        stats["hits"] += self.hits
+        stats["misses"] += self.misses
+        stats["evictions"] += self.evictions
+        entries = self.entry_stats()
+        stats["entries"] = len(entries)
+        stats["bytes"] = sum(size for _, size, _ in entries)
+
+        handle, temporary_name = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, "w") as f:
+            json.dump(stats, f, indent=2)
+        os.replace(temporary_name, self.stats_path())
+
+        self.hits = self.misses = self.evictions = 0
+        return stats
@@ -0,0 +1,469 @@
+import dataclasses
+import io
+import os
+import tomllib
+from dataclasses import dataclass
+from typing import IO
+
+from backend import Backend, FanOut, NullSink
+from conversion_cache import ConversionCache
+from drill_glyph import DEFAULT_CIRCLE_POINTS, get_drill_glyph
+from gerber import Gerber
+from igor_binary import IgorBinary
+from igor_writer import Igor
+from point import COUNTS_PER_INCH, DEFAULT_PRECISION, Point
+from run_stats import InstrumentedBackend, RunStats, TimedReader
+from simplify import Simplifier
+from spatial_index import SpatialIndex, Window
+from tokenizer import parallel_batches, prefetch_batches, stream_batches
+from toolpath import Toolpath
+
+# Settings read at startup. Command line options take precedence over them.
+CONFIG_FILE_NAME = "gerber_to_igor.toml"
+
+# Output formats. Several can be given separated by commas, like "itx,pxp", to write
+# them all from one pass over the file. "none" writes nothing.
+OUTPUT_FORMATS = ("itx", "pxp", "none")
+
+# Values of the units option: tenths of millimeters, hundredths of inches and
+# thousandths of inches (see point.Units.from_option).
+UNITS_OPTIONS = (1, 2, 3)
+
+# Extension of saved toolpaths, which can be converted in place of the Gerber file.
+TOOLPATH_EXTENSION = ".gtp"
+
+# Each level of detail after the first is simplified with this many times the
+# tolerance of the one before. Without a tolerance, the second level uses
+# DEFAULT_LOD_TOLERANCE (in inches).
+LOD_FACTOR = 4
+DEFAULT_LOD_TOLERANCE = 0.001
+
+
+@dataclass(frozen=True)
+class ConversionOptions:
+    # Settings for one conversion. The names match the command line options and
+    # the keys in gerber_to_igor.toml.
+    units: int = 2
+    cutoffset: str = "0,0"
+    markoffset: str = "0,0"
+    drilloffset: str = "0,0"
+    verbose: bool = False
+    precision: int = DEFAULT_PRECISION
+    format: str = "itx"
+    merge: bool = False
+    drillradius: str = "0.5"
+    drillpoints: int = DEFAULT_CIRCLE_POINTS
+    batchdrills: bool = False
+    jobs: int = 1
+    savetoolpath: bool = False
+    opcodestats: bool = False
+    pipeline: bool = False
+    simplify: float = 0.0
+    lodlevels: int = 1
+    instances: bool = False
+
+
+def output_formats(options: ConversionOptions) -> list[str]:
+    return options.format.split(",")
+
+
+def lod_basename(basename: str, level: int) -> str:
+    return basename if level == 1 else f"{basename}_lod{level}"
+
+
+def lod_tolerance(options: ConversionOptions, level: int) -> float:
+    # Simplification tolerance (in inches) of a level of detail, where level 1 is the
+    # main output.
+    if level == 1:
+        return options.simplify
+    return (options.simplify or DEFAULT_LOD_TOLERANCE / LOD_FACTOR) * (
+        LOD_FACTOR ** (level - 1)
+    )
+
+
+def output_file_names(basename: str, options: ConversionOptions) -> list[str]:
+    return [
+        f"{lod_basename(basename, level)}.{output_format}"
+        for level in range(1, options.lodlevels + 1)
+        for output_format in output_formats(options)
+        if output_format != "none"
+    ]
+
+
+def output_settings(options: ConversionOptions) -> dict:
+    # The options that change the output, as used for the cache key. Offsets are
+    # compared by value, so "1,1" and "1.0,1.00" are the same.
+    settings = dataclasses.asdict(options)
+    del settings["verbose"]
+    del settings["jobs"]
+    del settings["savetoolpath"]
+    del settings["opcodestats"]
+    del settings["pipeline"]
+    for name in ("markoffset", "cutoffset", "drilloffset"):
+        settings[name] = dataclasses.astuple(Point.from_text(settings[name]))
+    return settings
+
+
+def load_config(file_name: str = CONFIG_FILE_NAME) -> dict:
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, "rb") as f:
+        return tomllib.load(f)
+
+
+def options_from_dict(values: dict) -> ConversionOptions:
+    # Build options from a dict such as the config file or a server request, leaving
+    # out keys that aren't options.
+    names = {field.name for field in dataclasses.fields(ConversionOptions)}
+    return ConversionOptions(
+        **{name: value for name, value in values.items() if name in names}
+    )
+
+
+def toolpath_file_name(file_name: str) -> str:
+    basename, _ = os.path.splitext(file_name)
+    return basename + TOOLPATH_EXTENSION
+
+
+def is_toolpath_file(file_name: str) -> bool:
+    return file_name.lower().endswith(TOOLPATH_EXTENSION)
+
+
+def create_igor(
+    basename: str,
+    output_format: str = "itx",
+    precision: int = DEFAULT_PRECISION,
+    merge: bool = False,
+    drill_radius: str = "0.5",
+    drill_points: int = DEFAULT_CIRCLE_POINTS,
+    batch_drills: bool = False,
+    background_writes: bool = False,
+    stream: IO | None = None,
+    axis_window: Window | None = None,
+    instances: bool = False,
+) -> Igor:
+    # Create the Igor writer for basename plus the extension of the output format.
+    # With a stream, the output is written to it instead. With axis_window, the
+    # graph shows that region. With instances, repeated path shapes are written once.
+    glyph = get_drill_glyph(round(float(drill_radius) * COUNTS_PER_INCH), drill_points)
+    match output_format:
+        case "pxp":
+            return IgorBinary(
+                basename + ".pxp",
+                precision,
+                merge,
+                glyph,
+                batch_drills,
+                background_writes,
+                stream,
+                axis_window,
+                instances,
+            )
+        case _:
+            return Igor(
+                basename + ".itx",
+                precision,
+                merge,
+                glyph,
+                batch_drills,
+                background_writes,
+                stream,
+                axis_window,
+                instances,
+            )
+
+
+def create_output(
+    basename: str,
+    options: ConversionOptions,
+    streams: dict[str, IO] | None = None,
+    axis_window: Window | None = None,
+) -> Backend:
+    # Create the backend for the output formats in options, writing to basename plus
+    # the extension of each format. With streams, the output is kept in memory
+    # instead, in a stream per output file name added to streams. With axis_window,
+    # the graphs show that region. With several levels of detail, the levels after
+    # the first are written to name_lod2, name_lod3 and so on.
+    backends = []
+    for level in range(1, options.lodlevels + 1):
+        level_basename = lod_basename(basename, level)
+        backend = create_level_output(level_basename, options, streams, axis_window)
+        tolerance = round(lod_tolerance(options, level) * COUNTS_PER_INCH)
+        if tolerance > 0:
+            backend = Simplifier(backend, tolerance, level_basename)
+        backends.append(backend)
+    return backends[0] if len(backends) == 1 else FanOut(backends)
+
+
+def create_level_output(
+    basename: str,
+    options: ConversionOptions,
+    streams: dict[str, IO] | None = None,
+    axis_window: Window | None = None,
+) -> Backend:
+    # Create the backend for one level of detail of the output. See create_output.
+    backends = []
+    for output_format in output_formats(options):
+        stream = None
+        if streams is not None and output_format != "none":
+            stream = io.BytesIO() if output_format == "pxp" else io.StringIO()
+            streams[f"{basename}.{output_format}"] = stream
+
+        if output_format == "none":
+            backends.append(NullSink())
+        else:
+            backends.append(
+                create_igor(
+                    basename,
+                    output_format,
+                    options.precision,
+                    options.merge,
+                    options.drillradius,
+                    options.drillpoints,
+                    options.batchdrills,
+                    options.pipeline,
+                    stream,
+                    axis_window,
+                    options.instances,
+                )
+            )
+    return backends[0] if len(backends) == 1 else FanOut(backends)
+
+
+def create_gerber(
+    options: ConversionOptions,
+    backend: Backend,
+    toolpath: Toolpath | None = None,
+    through_stops: bool = False,
+) -> Gerber:
+    # Create the interpreter for a Gerber file with the settings in options. The
+    # paths and drill hits go to backend, usually made by create_output.
+    return Gerber(
+        options.units,
+        options.cutoffset,
+        options.markoffset,
+        options.drilloffset,
+        options.verbose,
+        backend,
+        toolpath,
+        options.opcodestats,
+        through_stops,
+    )
+
+
+def run_gerber(
+    gerber: Gerber,
+    file_name: str,
+    jobs: int = 1,
+    pipeline: bool = False,
+    stats: RunStats | None = None,
+) -> None:
+    # Feed the commands in a Gerber file to gerber until the end or a stop code. With
+    # pipeline, the file is read and tokenized in a background thread. With stats,
+    # tokens are counted and reading, tokenizing and interpreting are timed.
+    with open(file_name, "r") as gerber_file:
+        if jobs > 1:
+            batches = parallel_batches(file_name, jobs)
+        elif stats is not None:
+            batches = stream_batches(TimedReader(gerber_file, stats))
+        else:
+            batches = stream_batches(gerber_file)
+        if pipeline:
+            batches = prefetch_batches(batches)
+
+        if stats is None:
+            for batch in batches:
+                should_stop = gerber.command_batch(batch)
+                if should_stop:
+                    break
+        else:
+            while True:
+                with stats.stage("tokenize"):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                stats.count("tokens", len(batch))
+                with stats.stage("interpret"):
+                    should_stop = gerber.command_batch(batch)
+                if should_stop:
+                    break
+        batches.close()
+
+
+def compile_toolpath(
+    file_name: str, options: ConversionOptions, through_stops: bool = False
+) -> Toolpath:
+    # Read a Gerber file into a toolpath without writing any Igor output. A saved
+    # toolpath is loaded instead. With through_stops, the whole file is read and each
+    # M0 is kept as a STOP record.
+    if is_toolpath_file(file_name):
+        return Toolpath.load(file_name)
+
+    toolpath = Toolpath()
+    gerber = create_gerber(options, NullSink(), toolpath, through_stops)
+    run_gerber(gerber, file_name, options.jobs, options.pipeline)
+    gerber.finish()
+    return toolpath
+
+
+def tool_offsets(options: ConversionOptions) -> list[Point]:
+    # The mark, cut and drill offsets in options, indexed by tool number.
+    return [
+        Point.from_text(options.markoffset),
+        Point.from_text(options.cutoffset),
+        Point.from_text(options.drilloffset),
+    ]
+
+
+def render_toolpath(
+    toolpath: Toolpath, basename: str, options: ConversionOptions
+) -> list[str]:
+    # Write the output for a toolpath with the offsets in options to basename plus
+    # the extension of each output format, and return the output file names.
+    backend = create_output(basename, options)
+    try:
+        toolpath.render(backend, tool_offsets(options))
+    except BaseException:
+        backend.abort()
+        raise
+    return output_file_names(basename, options)
+
+
+def sweep_options(options: ConversionOptions, offsets: str) -> ConversionOptions:
+    # Replace the offsets in options with ones given as MARK:CUT:DRILL, for example
+    # "0,0:0.1,0:0,0.05".
+    parts = offsets.split(":")
+    if len(parts) != 3:
+        raise ValueError(f"Offsets {offsets} should be given as MARK:CUT:DRILL.")
+    return dataclasses.replace(
+        options, markoffset=parts[0], cutoffset=parts[1], drilloffset=parts[2]
+    )
+
+
+def convert_sweep(
+    file_name: str, options: ConversionOptions, sweep: list[str]
+) -> list[str]:
+    # Read a Gerber file once and write one output per set of offsets in sweep, named
+    # like name_offset1.itx, name_offset2.itx and so on. Return the output file names.
+    toolpath = compile_toolpath(file_name, options)
+    if options.savetoolpath and not is_toolpath_file(file_name):
+        toolpath.save(toolpath_file_name(file_name))
+
+    basename, _ = os.path.splitext(file_name)
+    output_names = []
+    for number, offsets in enumerate(sweep, 1):
+        output_names += render_toolpath(
+            toolpath, f"{basename}_offset{number}", sweep_options(options, offsets)
+        )
+    return output_names
+
+
+def index_file(file_name: str, options: ConversionOptions) -> SpatialIndex:
+    # Read a Gerber file or saved toolpath into a spatial index of its paths and drill
+    # hits, with the offsets in options.
+    index = SpatialIndex()
+    if is_toolpath_file(file_name):
+        Toolpath.load(file_name).render(index, tool_offsets(options))
+    else:
+        gerber = create_gerber(options, index)
+        run_gerber(gerber, file_name, options.jobs, options.pipeline)
+        gerber.finish()
+    return index
+
+
+def convert_windows(
+    file_name: str, options: ConversionOptions, windows: list[str]
+) -> list[str]:
+    # Read a file once and write the paths and drill hits in each region in windows,
+    # given as x0,y0,x1,y1 in inches, to name_window1.itx, name_window2.itx and so
+    # on. Paths are cut at the edges of the region. Return the output file names.
+    regions = [Window.from_text(text) for text in windows]
+    index = index_file(file_name, options)
+
+    basename, _ = os.path.splitext(file_name)
+    output_names = []
+    for number, window in enumerate(regions, 1):
+        window_basename = f"{basename}_window{number}"
+        backend = create_output(window_basename, options, axis_window=window)
+        try:
+            index.export(window, backend)
+        except BaseException:
+            backend.abort()
+            raise
+        output_names += output_file_names(window_basename, options)
+    return output_names
+
+
+def convert_file(
+    file_name: str,
+    options: ConversionOptions,
+    cache: ConversionCache | None = None,
+    stats: RunStats | None = None,
+) -> list[str]:
+    # Convert one Gerber file and return the names of the output files. If the
+    # conversion fails, the partial output is removed. With a cache, the output of
+    # an earlier conversion of the same input and settings is reused. A saved
+    # toolpath is rendered without reading the Gerber file again. With stats, the
+    # work of the conversion is added to stats.
+    basename, _ = os.path.splitext(file_name)
+    output_names = output_file_names(basename, options)
+    if cache is not None and output_names:
+        key = cache.key(file_name, output_settings(options))
+        # The file has to be read anyway if its toolpath should be saved.
+        needs_toolpath = options.savetoolpath and not os.path.exists(
+            toolpath_file_name(file_name)
+        )
+        hit = not needs_toolpath and all(
+            cache.fetch(key, output_name[len(basename) :], output_name)
+            for output_name in output_names
+        )
+        cache.count(hit)
+        if hit:
+            return output_names
+
+    if is_toolpath_file(file_name):
+        render_toolpath(Toolpath.load(file_name), basename, options)
+    else:
+        toolpath = Toolpath() if options.savetoolpath else None
+        backend = create_output(basename, options)
+        if stats is not None:
+            backend = InstrumentedBackend(backend, stats)
+        gerber = create_gerber(options, backend, toolpath)
+        try:
+            run_gerber(gerber, file_name, options.jobs, options.pipeline, stats)
+        except BaseException:
+            gerber.abort()
+            raise
+
+        gerber.finish()
+        if toolpath is not None:
+            toolpath.save(toolpath_file_name(file_name))
+    if stats is not None:
+        stats.count("files")
+        stats.count("bytes_written", sum(map(os.path.getsize, output_names)))
+
+    if cache is not None and output_names:
+        for output_name in output_names:
+            cache.store(key, output_name[len(basename) :], output_name)
+    return output_names
+
+
+def convert_text(
+    gerber_text: str, options: ConversionOptions, name: str = "gerber"
+) -> dict[str, str | bytes]:
+    # Convert Gerber commands held in memory without using the disk. Return the
+    # output of each format keyed by its file name, like name.itx. Text formats are
+    # returned as str and binary ones as bytes.
+    streams = {}
+    gerber = create_gerber(options, create_output(name, options, streams))
+    try:
+        for batch in stream_batches(io.StringIO(gerber_text)):
+            should_stop = gerber.command_batch(batch)
+            if should_stop:
+                break
+    except BaseException:
+        gerber.abort()
+        raise
+
+    gerber.finish()
+    return {output_name: stream.getvalue() for output_name, stream in streams.items()}
@@ -0,0 +1,74 @@
+import functools
+import math
+from typing import Iterable
+
+from point import COUNTS_PER_INCH, Point
+
+# Default size of the glyph drawn for a drill hit.
+DEFAULT_DRILL_RADIUS = COUNTS_PER_INCH // 2
+DEFAULT_CIRCLE_POINTS = 20
+
+
+class DrillGlyph:
+    # The circle around a cross that marks a drill hit. The shape is computed once as
+    # offsets in counts and then translated to each hit.
+    __slots__ = ("radius", "circle_points", "dxs", "dys")
+
+    radius: int
+    circle_points: int
+    dxs: list[float]
+    dys: list[float]
+
+    def __init__(self, radius: int, circle_points: int):
+        self.radius = radius
+        self.circle_points = circle_points
+
+        # Start with the horizontal leg of the cross.
+        self.dxs = [-radius, radius]
+        self.dys = [0, 0]
+
+        # Draw the circle.
+        for point_number in range(circle_points):
+            t = math.pi * 2 * (point_number + 1) / circle_points
+            self.dxs.append(round(math.cos(t) * radius))
+            self.dys.append(round(math.sin(t) * radius))
+
+        # Insert NaN point to break the drawing between the end of the circle
+        # and the beginning of the vertical leg of the cross.
+        self.dxs.append(math.nan)
+        self.dys.append(math.nan)
+
+        # Draw the vertical leg of the cross.
+        self.dxs += [0, 0]
+        self.dys += [-radius, radius]
+
+    def __len__(self) -> int:
+        return len(self.dxs)
+
+    def at(self, location: Point) -> tuple[list[float], list[float]]:
+        # Return the glyph for a drill hit at location, in inches.
+        return (
+            [(location.x + dx) / COUNTS_PER_INCH for dx in self.dxs],
+            [(location.y + dy) / COUNTS_PER_INCH for dy in self.dys],
+        )
+
+    def at_many(self, locations: Iterable[Point]) -> tuple[list[float], list[float]]:
+        # Return the glyphs for several drill hits as one line, in inches, with a NaN
+        # point between glyphs.
+        xs = []
+        ys = []
+        for location in locations:
+            if xs:
+                xs.append(math.nan)
+                ys.append(math.nan)
+            glyph_xs, glyph_ys = self.at(location)
+            xs += glyph_xs
+            ys += glyph_ys
+        return xs, ys
+
+
+@functools.cache
+def get_drill_glyph(
+    radius: int = DEFAULT_DRILL_RADIUS, circle_points: int = DEFAULT_CIRCLE_POINTS
+) -> DrillGlyph:
+    return DrillGlyph(radius, circle_points)
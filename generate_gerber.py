@@ -0,0 +1,131 @@
+import argparse
+import dataclasses
+import random
+from dataclasses import dataclass
+from typing import TextIO
+
+# Coordinates are kept within this many units of the origin.
+COORDINATE_RANGE = 10000
+
+# Commands that change the units.
+UNITS_COMMANDS = ["G70", "G71", "G91"]
+
+
+@dataclass(frozen=True)
+class Workload:
+    # How much of each kind of work a generated file contains. Everything but the
+    # number of patterns is per pattern.
+    patterns: int = 4
+    # Long marked runs of X..Y.. coordinates between D1 and D2.
+    runs: int = 20
+    run_length: int = 500
+    # Short cut segments between B and A.
+    cuts: int = 2000
+    # A square grid of drill hits, alternately R and M43.
+    drill_grid: int = 30
+    # Number of times the units change, spread over the runs.
+    unit_switches: int = 2
+
+
+# Workloads for the benchmark suite, from a few hundred kilobytes to tens of
+# megabytes.
+WORKLOADS = {
+    "small": Workload(patterns=2, runs=10, run_length=200, cuts=500, drill_grid=10),
+    "medium": Workload(),
+    "large": Workload(patterns=8, runs=100, run_length=2000, cuts=20000, drill_grid=60),
+}
+
+
+def coordinate(x: int, y: int) -> str:
+    return f"X{x}Y{y}*"
+
+
+def random_walk(rng: random.Random, length: int, step: int) -> list[str]:
+    x = rng.randrange(-COORDINATE_RANGE, COORDINATE_RANGE)
+    y = rng.randrange(-COORDINATE_RANGE, COORDINATE_RANGE)
+    commands = []
+    for _ in range(length):
+        x = max(-COORDINATE_RANGE, min(COORDINATE_RANGE, x + rng.randint(-step, step)))
+        y = max(-COORDINATE_RANGE, min(COORDINATE_RANGE, y + rng.randint(-step, step)))
+        commands.append(coordinate(x, y))
+    return commands
+
+
+def write_pattern(
+    out: TextIO, workload: Workload, number: int, rng: random.Random
+) -> None:
+    out.write(f"H{number}*M70*D2*M15*N{number}*M26*\n")
+
+    switch_every = workload.runs // (workload.unit_switches + 1) or 1
+    switches = 0
+    for run in range(workload.runs):
+        if switches < workload.unit_switches and run % switch_every == switch_every - 1:
+            out.write(UNITS_COMMANDS[rng.randrange(len(UNITS_COMMANDS))] + "*\n")
+            switches += 1
+        walk = random_walk(rng, workload.run_length, 200)
+        out.write(walk[0] + "D1*" + "".join(walk[1:]) + "D2*\n")
+
+    for _ in range(workload.cuts):
+        start, end = random_walk(rng, 2, 50)
+        out.write(f"{start}B*{end}A*\n")
+
+    spacing = 2 * COORDINATE_RANGE // max(workload.drill_grid, 1)
+    for row in range(workload.drill_grid):
+        y = -COORDINATE_RANGE + row * spacing
+        out.write(
+            "".join(
+                coordinate(-COORDINATE_RANGE + column * spacing, y)
+                + ("R*" if (row + column) % 2 else "M43*")
+                for column in range(workload.drill_grid)
+            )
+            + "\n"
+        )
+
+    out.write("M15*M70*M0*\n")
+
+
+def generate(out: TextIO, workload: Workload, seed: int = 0) -> None:
+    # Write a Gerber program with the given amounts of work. The same seed always
+    # gives the same program.
+    rng = random.Random(seed)
+    for number in range(1, workload.patterns + 1):
+        write_pattern(out, workload, number, rng)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic Gerber file for testing and benchmarking."
+    )
+    parser.add_argument("output", help="Gerber file to write.")
+    parser.add_argument(
+        "-w",
+        "--workload",
+        help="Workload to start from. The options below change parts of it. (Default medium)",
+        choices=list(WORKLOADS),
+        default="medium",
+    )
+    for field in dataclasses.fields(Workload):
+        parser.add_argument(
+            f"--{field.name.replace('_', '')}",
+            dest=field.name,
+            help=f"Override the workload's {field.name.replace('_', ' ')}.",
+            type=int,
+        )
+    parser.add_argument(
+        "-s", "--seed", help="Random seed. (Default 0)", type=int, default=0
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    workload = dataclasses.replace(
+        WORKLOADS[args.workload],
+        **{
+            field.name: getattr(args, field.name)
+            for field in dataclasses.fields(Workload)
+            if getattr(args, field.name) is not None
+        },
+    )
+    with open(args.output, "w") as f:
+        generate(f, workload, args.seed)
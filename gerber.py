@@ -1,87 +1,114 @@
 import logging
-import os
-from enum import Enum
+import time
+from typing import Callable
 
-from gerber_token import Token
-from igor_writer import Igor
-from point import Point, Units
+from backend import Backend
+from gerber_token import COORDINATE_CODE, NO_VALUE, Token, TokenBatch
+from opcode_stats import OpcodeStats
+from path_buffer import PathBuffer
+from point import Point, Tool, Units
+from toolpath import DRILL, FILE, ORIGIN, PATTERN, RETURN, SPEED, STOP, Toolpath
+
+# Runs a Gerber command given its value and returns true if processing should stop.
+Handler = Callable[[int | None], bool | None]
 
 
 class GerberDataError(Exception):
     pass
 
 
-class Tool(Enum):
-    NONE = -1
-    MARK = 0
-    CUT = 1
-    DRILL = 2
-
-
 class Gerber:
-    fileName: str
     units: Units
     offsets: list[Point]
 
-    origin: Point
-    current_path: list[Point]
-    current_location: Point
+    # Locations are kept in counts (see point.COUNTS_PER_INCH).
+    origin_x: int
+    origin_y: int
+    current_path: PathBuffer
+    current_x: int
+    current_y: int
     current_tool: Tool
     tool_is_down: bool
-    pattern_number = -1
-    file_number = -1
+    # Whether normal speed was resumed during the current path. The toolpath
+    # records it after the path.
+    speed_resumed: bool
+    pattern_number: int | None
+    file_number: int | None
 
-    igor: Igor
+    # Receives the paths and drill hits, such as the Igor output built by
+    # converter.create_output.
+    backend: Backend
+    toolpath: Toolpath | None
+    # Whether to keep reading after M0, which then only ends a pattern.
+    through_stops: bool
 
+    handlers: dict[tuple[int, int], Handler]
+    family_handlers: dict[int, Handler]
+    opcode_stats: OpcodeStats | None
+
+    # Debug output is only written for verbose conversions. The logger is shared, so
+    # its level is left to the application.
+    verbose: bool
     logger: logging.Logger
 
     def __init__(
         self,
-        fileName: str,
         units: int,
         cutoffset: str,
         markoffset: str,
         drilloffset: str,
         verbose: bool,
+        backend: Backend,
+        toolpath: Toolpath | None = None,
+        opcode_stats: bool = False,
+        through_stops: bool = False,
     ):
-        basename, _ = os.path.splitext(fileName)
-        self.igor = Igor(basename + ".itx")
-
-        match units:
-            case 1:
-                self.units = Units.TENTHS
-            case 3:
-                self.units = Units.THOUSANDTHS
-            case _:
-                # Default to hundredths.
-                self.units = Units.HUNDREDTHS
+        self.backend = backend
+        self.units = Units.from_option(units)
 
         self.offsets = []
         self.offsets.append(Point.from_text(markoffset))
         self.offsets.append(Point.from_text(cutoffset))
         self.offsets.append(Point.from_text(drilloffset))
+        self.toolpath = toolpath
+        self.through_stops = through_stops
+        self.opcode_stats = OpcodeStats() if opcode_stats else None
+        self.build_handlers()
 
-        logging.basicConfig(format="%(message)s")
+        self.verbose = verbose
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG if verbose else logging.INFO)
 
-        self.origin = Point.from_xy(0, 0, self.units)
-        self.current_path = []
+        self.origin_x = 0
+        self.origin_y = 0
+        self.current_path = PathBuffer()
+        self.current_x = 0
+        self.current_y = 0
         self.current_tool = Tool.NONE
         self.tool_is_down = False
+        self.speed_resumed = False
+        self.pattern_number = -1
+        self.file_number = -1
+
+    @property
+    def current_location(self) -> Point:
+        return Point(self.current_x, self.current_y)
 
     def finish(self) -> None:
-        self.igor.finish()
+        self.backend.finish()
+        if self.opcode_stats is not None:
+            self.logger.info(self.opcode_stats.report())
 
-    def offset_current_path(self):
-        return map(
-            lambda point: point + self.offsets[self.current_tool], self.current_path
-        )
+    def abort(self) -> None:
+        self.backend.abort()
+
+    def set_units(self, units: Units):
+        self.units = units
 
     def tool_down(self, tool: Tool):
-        self.logger.debug(f"Tool {tool} down.")
+        if self.verbose:
+            self.logger.debug("Tool %s down.", tool)
         self.current_tool = tool
-        self.current_path.append(self.current_location)
+        self.current_path.append(self.current_x, self.current_y)
         self.tool_is_down = True
 
     def drill(self):
@@ -89,100 +116,204 @@ class Gerber:
             raise GerberDataError(
                 "There should not be a path when the drill command executes."
             )
-        self.igor.plot_drill(self.current_location + self.offsets[Tool.DRILL.value])
+        if self.toolpath is not None:
+            self.toolpath.add(DRILL, self.current_x, self.current_y)
+        self.backend.plot_drill(self.current_location + self.offsets[Tool.DRILL.value])
 
     def tool_up(self):
-        self.logger.debug("Tool up.")
+        if self.verbose:
+            self.logger.debug("Tool up.")
         if len(self.current_path):
-            self.igor.plot_path(
+            if self.toolpath is not None:
+                self.toolpath.add_path(self.current_tool, self.current_path)
+                if self.speed_resumed:
+                    self.toolpath.add(SPEED, 0)
+            self.backend.plot_path(
                 self.current_tool,
-                list(
-                    map(
-                        lambda p: p + self.offsets[self.current_tool.value],
-                        self.current_path,
-                    )
-                ),
+                self.current_path.translated(self.offsets[self.current_tool.value]),
             )
-        self.current_path = []
+        self.current_path = PathBuffer()
         self.current_tool = Tool.NONE
         self.tool_is_down = False
+        self.speed_resumed = False
 
     def move(self, x: int, y: int):
-        self.current_location = Point.from_xy(x, y, self.units)
-        self.logger.debug(f"Move to {self.current_location}")
+        self.current_x = x * self.units.counts
+        self.current_y = y * self.units.counts
+        if self.verbose:
+            self.logger.debug("Move to %s", self.current_location)
         if self.tool_is_down:
-            self.current_path.append(self.current_location)
+            self.current_path.append(self.current_x, self.current_y)
+
+    def restore_state(self, units: Units, origin: Point, location: Point) -> None:
+        # Start from the state an earlier part of the file left, for converting a file
+        # in parts.
+        self.units = units
+        self.origin_x = origin.x
+        self.origin_y = origin.y
+        self.current_x = location.x
+        self.current_y = location.y
 
     def set_origin(self):
-        self.origin = self.current_location
+        self.origin_x = self.current_x
+        self.origin_y = self.current_y
+        if self.toolpath is not None:
+            self.toolpath.add(ORIGIN, self.origin_x, self.origin_y)
 
     def go_to_origin(self):
-        self.current_location = self.origin
+        self.current_x = self.origin_x
+        self.current_y = self.origin_y
         if self.tool_is_down:
-            self.current_path.append(self.current_location)
+            self.current_path.append(self.current_x, self.current_y)
+        elif self.toolpath is not None:
+            self.toolpath.add(RETURN, self.origin_x, self.origin_y)
 
     def set_pattern_number(self, pattern_number: int):
+        if self.toolpath is not None:
+            self.toolpath.add(
+                PATTERN, NO_VALUE if pattern_number is None else pattern_number
+            )
+        self.backend.end_pattern()
         self.pattern_number = pattern_number
 
     def set_file_number(self, file_number: int):
+        if self.toolpath is not None:
+            self.toolpath.add(FILE, NO_VALUE if file_number is None else file_number)
         self.file_number = file_number
 
     def resume_normal_speed(self):
-        pass
+        if self.toolpath is None:
+            return
+        if self.tool_is_down:
+            self.speed_resumed = True
+        else:
+            self.toolpath.add(SPEED, 0)
+
+    def unexpected(self, description: str) -> Handler:
+        # A handler for commands this converter doesn't support.
+        def handler(value: int | None) -> None:
+            raise NotImplementedError(f"Wasn't expecting {description}.")
+
+        return handler
+
+    def build_handlers(self) -> None:
+        # Build the dispatch tables. Commands are looked up on (character code, value)
+        # first and then on the character code alone.
+        def stop(value: int | None) -> bool:
+            # M0 is stop code. Reading through stops, it ends the pattern instead.
+            if self.through_stops:
+                if self.toolpath is not None:
+                    self.toolpath.add(STOP, 0)
+                self.backend.end_pattern()
+                return False
+            return True
+
+        def ignore(value: int | None) -> None:
+            pass
+
+        def tool_up(value: int | None) -> None:
+            self.tool_up()
+
+        def cut_down(value: int | None) -> None:
+            self.tool_down(Tool.CUT)
+
+        def drill(value: int | None) -> None:
+            self.drill()
+
+        def resume_normal_speed(value: int | None) -> None:
+            self.resume_normal_speed()
+
+        flick_notch = self.unexpected("E/M68 (Flick notch)")
+
+        self.handlers = {
+            (ord("M"), 0): stop,
+            (ord("D"), 1): lambda value: self.tool_down(Tool.MARK),
+            (ord("D"), 2): tool_up,
+            (ord("G"), 4): lambda value: self.set_origin(),
+            (ord("G"), 70): lambda value: self.set_units(Units.THOUSANDTHS),
+            (ord("G"), 71): lambda value: self.set_units(Units.TENTHS),
+            (ord("G"), 91): lambda value: self.set_units(Units.HUNDREDTHS),
+            (ord("M"), 14): cut_down,
+            (ord("M"), 15): tool_up,
+            (ord("M"), 26): resume_normal_speed,
+            (ord("M"), 30): self.unexpected("M30 (Rewind data file)"),
+            (ord("M"), 43): drill,
+            (ord("M"), 44): drill,
+            (ord("M"), 68): flick_notch,
+            (ord("M"), 69): self.unexpected("M69 (Conveyor bite)"),
+            (ord("M"), 70): lambda value: self.go_to_origin(),
+        }
+        # Commands that do the same thing whatever their value. Other G and M codes
+        # are ignored.
+        self.family_handlers = {
+            ord("A"): tool_up,
+            ord("B"): cut_down,
+            ord("E"): flick_notch,
+            ord("G"): ignore,
+            ord("H"): self.set_file_number,
+            ord("M"): ignore,
+            ord("N"): self.set_pattern_number,
+            ord("O"): resume_normal_speed,
+            ord("R"): drill,
+            ord("/"): self.unexpected("'/' (Block delete)"),
+        }
 
     def command(self, cmd: Token) -> bool:
         # Process a Gerber command. Return true if processing should stop.
-        # self.logger.debug(cmd)
         if cmd.is_coordinate:
             self.move(cmd.x, cmd.y)
             return False
 
-        if cmd.code == "M" and cmd.value == 0:
-            # M0 is stop code.
-            return True
+        return self.execute(cmd.code, cmd.value)
 
-        if (
-            cmd.code == "A"
-            or (cmd.code == "D" and cmd.value == 2)
-            or (cmd.code == "M" and cmd.value == 15)
-        ):
-            self.tool_up()
-        elif cmd.code == "B" or (cmd.code == "M" and cmd.value == 14):
-            self.tool_down(Tool.CUT)
-        elif cmd.code == "D" and cmd.value == 1:
-            self.tool_down(Tool.MARK)
-        elif cmd.code == "G":
-            if cmd.value == 4:
-                self.set_origin()
-            elif cmd.value == 70:
-                self.units = Units.THOUSANDTHS
-            elif cmd.value == 71:
-                self.units = Units.TENTHS
-            elif cmd.value == 91:
-                self.units = Units.HUNDREDTHS
-        elif cmd.code == "H":
-            self.set_file_number(cmd.value)
-        elif cmd.code == "N":
-            self.set_pattern_number(cmd.value)
-        elif cmd.code == "O" or (cmd.code == "M" and cmd.value == 26):
-            self.resume_normal_speed()
-        elif cmd.code == "R" or (
-            cmd.code == "M" and (cmd.value == 43 or cmd.value == 44)
-        ):
-            self.drill()
-        elif cmd.code == "E" or (cmd.code == "M" and cmd.value == 68):
-            raise NotImplementedError("Wasn't expecting E/M68 (Flick notch).")
-        elif cmd.code == "M":
-            if cmd.value == 70:
-                self.go_to_origin()
-            elif cmd.value == 30:
-                raise NotImplementedError("Wasn't expecting M30 (Rewind data file).")
-            elif cmd.value == 69:
-                raise NotImplementedError("Wasn't expecting M69 (Conveyor bite).")
-        elif cmd.code == "/":
-            raise NotImplementedError("Wasn't expecting '/' (Block delete).")
-        else:
-            self.logger.info(f"Didn't process command {cmd}.")
+    def command_batch(self, batch: TokenBatch) -> bool:
+        # Process a batch of Gerber commands. Return true if processing should stop.
+        if self.opcode_stats is not None:
+            return self.command_batch_counted(batch)
 
-        # Return false to indicate processing should continue.
+        handlers = self.handlers
+        family_handlers = self.family_handlers
+        for code, value, x, y in zip(batch.codes, batch.values, batch.xs, batch.ys):
+            if code == COORDINATE_CODE:
+                self.move(x, y)
+                continue
+            handler = handlers.get((code, value)) or family_handlers.get(code)
+            if handler is None:
+                self.not_processed(code, value)
+            elif handler(None if value == NO_VALUE else value):
+                return True
         return False
+
+    def command_batch_counted(self, batch: TokenBatch) -> bool:
+        # command_batch, counting and timing each command in opcode_stats.
+        for code, value, x, y in zip(batch.codes, batch.values, batch.xs, batch.ys):
+            start = time.perf_counter_ns()
+            if code == COORDINATE_CODE:
+                self.move(x, y)
+                should_stop = False
+            else:
+                should_stop = self.dispatch(code, value)
+            self.opcode_stats.add(code, value, time.perf_counter_ns() - start)
+            if should_stop:
+                return True
+        return False
+
+    def execute(self, code: str, value: int | None) -> bool:
+        # Process a Gerber command that isn't a coordinate. Return true if processing
+        # should stop.
+        return self.dispatch(ord(code), NO_VALUE if value is None else value)
+
+    def dispatch(self, code: int, value: int) -> bool:
+        # Process a command given as it is stored in a TokenBatch. Return true if
+        # processing should stop.
+        handler = self.handlers.get((code, value)) or self.family_handlers.get(code)
+        if handler is None:
+            self.not_processed(code, value)
+            return False
+        return bool(handler(None if value == NO_VALUE else value))
+
+    def not_processed(self, code: int, value: int) -> None:
+        self.logger.info(
+            f"Didn't process command "
+            f"{Token.from_command(chr(code), None if value == NO_VALUE else value)}."
+        )
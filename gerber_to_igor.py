@@ -1,24 +1,59 @@
 import argparse
-import os
-import re
-from typing import Iterator
+import cProfile
+import dataclasses
+import json
+import logging
+import sys
+import time
 
-import tomllib
+import batch
+import metrics
+import optimize
+import patterns
+import watch
+from conversion_cache import DEFAULT_MAX_AGE_DAYS, ConversionCache
+from converter import (
+    LOD_FACTOR,
+    OUTPUT_FORMATS,
+    UNITS_OPTIONS,
+    ConversionOptions,
+    convert_file,
+    convert_sweep,
+    convert_windows,
+    load_config,
+)
+from run_stats import RunStats
 
-from gerber import Gerber
-from gerber_token import Token
+# Options that each replace the usual conversion with another kind of run. Only one
+# can be given, and the cache and --stats only apply to the usual conversion.
+MODE_OPTIONS = ("sweep", "window", "optimize", "patterns", "watch", "metrics")
+
+
+def output_formats(text: str) -> str:
+    for output_format in text.split(","):
+        if output_format not in OUTPUT_FORMATS:
+            raise argparse.ArgumentTypeError(
+                f"invalid format: '{output_format}'"
+                f" (choose from {', '.join(OUTPUT_FORMATS)})"
+            )
+    return text
 
 
 def build_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
-    parser.add_argument("gerberfile", help="Gerber file to translate.")
+    parser.add_argument(
+        "gerberfile",
+        help="Gerber file to translate. Give several files, directories or glob patterns to convert them in a batch. A toolpath saved with --savetoolpath (.gtp) can be given instead of a Gerber file.",
+        nargs="+",
+    )
 
     # Length Units are "Hundredths of Inches", "Thousandths of Inches", and "Tenths of Millimeters"
     parser.add_argument(
         "-u",
         "--units",
         help="Units: 1 = tenths of millimeters, 2 = hundredths of inches, 3 = thousandths of inches. (Default: 2)",
-        choices=[1, 2, 3],
+        type=int,
+        choices=UNITS_OPTIONS,
     )
 
     # Mark tool offset
@@ -36,6 +71,178 @@ def build_arg_parser() -> argparse.ArgumentParser:
         "-d", "--drilloffset", help="Drill tool offset (in inches). (Default 0,0)"
     )
 
+    # Output precision
+    parser.add_argument(
+        "-p",
+        "--precision",
+        help="Decimal places written for coordinates in inches. (Default 4)",
+        type=int,
+    )
+
+    # Output format
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output format: itx = Igor text, pxp = Igor packed experiment with binary waves, none = no output, for timing. Give several separated by commas, like itx,pxp, to write them all from one pass. (Default: itx)",
+        type=output_formats,
+    )
+
+    # Simplification
+    parser.add_argument(
+        "--simplify",
+        help="Remove path vertices that are within this distance (in inches) of the simplified path. The ends of paths and drill hits are kept. (Default: 0, no simplification)",
+        type=float,
+    )
+    parser.add_argument(
+        "--lodlevels",
+        help=f"Also write coarser levels of detail to name_lod2, name_lod3 and so on, up to this many levels, each simplified with {LOD_FACTOR} times the distance of the one before. (Default: 1, only the main output)",
+        type=int,
+    )
+
+    # Merged waves
+    parser.add_argument(
+        "--merge",
+        help="Write one wave per tool instead of one wave per path.",
+        action="store_true",
+    )
+
+    # Shape instancing
+    parser.add_argument(
+        "--instances",
+        help="Write each distinct path shape once and every path with that shape as a command that copies it into place when Igor loads the output. Makes the output of step-and-repeat jobs much smaller.",
+        action="store_true",
+    )
+
+    # Drill glyph
+    parser.add_argument(
+        "--drillradius",
+        help="Radius of the circle drawn for each drill hit (in inches). (Default 0.5)",
+    )
+    parser.add_argument(
+        "--drillpoints",
+        help="Number of points in the circle drawn for each drill hit. (Default 20)",
+        type=int,
+    )
+    parser.add_argument(
+        "--batchdrills",
+        help="Write all of the drill hits in a pattern as one wave.",
+        action="store_true",
+    )
+
+    # Parallel tokenization
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Tokenize the file in this many worker processes. (Default 1)",
+        type=int,
+    )
+
+    # Modes, see MODE_OPTIONS
+    modes = parser.add_mutually_exclusive_group()
+
+    # Toolpaths
+    parser.add_argument(
+        "--savetoolpath",
+        help="Save the toolpath read from the Gerber file next to it (.gtp) so it can be converted again with other offsets without reading the Gerber file.",
+        action="store_true",
+    )
+    modes.add_argument(
+        "--sweep",
+        help="Offsets (in inches) as MARK:CUT:DRILL, for example 0,0:0.1,0:0,0. Give several times to read each file once and write name_offset1, name_offset2 and so on, one per set of offsets.",
+        action="append",
+    )
+
+    # Windows
+    modes.add_argument(
+        "--window",
+        help="Region (in inches) as x0,y0,x1,y1. Write only the paths and drill hits in it, with paths cut at its edges and the axes fitted to it, to name_window1. Give several times to read each file once and write name_window1, name_window2 and so on. Give regions with negative values with an equals sign, like --window=-1,-1,1,1.",
+        action="append",
+    )
+
+    # Optimization
+    modes.add_argument(
+        "--optimize",
+        help="Reorder the paths and drill hits to shorten the travel with the tool up, keeping each tool's work together and the patterns, file numbers, origins, returns to the origin (M70) and speed changes (M26) where they are, write the new order to name_optimized.gbr and its output to name_optimized, and print the travel before and after.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--reversepaths",
+        help="With --optimize, allow paths to be run backwards to shorten the travel further.",
+        action="store_true",
+    )
+
+    # Patterns
+    modes.add_argument(
+        "--patterns",
+        help="Convert each pattern (the commands up to each M0) to its own output file, name_pattern1, name_pattern2 and so on, in worker processes, and write an index of them to name_patterns.json.",
+        action="store_true",
+    )
+
+    modes.add_argument(
+        "--watch",
+        help="Convert each pattern to its own output as --patterns does, then keep running and convert again only the patterns that change whenever the files are saved, until interrupted with Ctrl-C.",
+        action="store_true",
+    )
+
+    # Pipelining
+    parser.add_argument(
+        "--pipeline",
+        help="Read and tokenize the file and write the output in background threads while the commands are interpreted.",
+        action="store_true",
+    )
+
+    # Batch conversion
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of worker processes for batch conversion. (Default: number of CPUs)",
+        type=int,
+    )
+
+    # Conversion cache
+    parser.add_argument(
+        "--cache",
+        help="Directory of a cache of earlier conversions. Unchanged files are copied from it instead of being converted again.",
+    )
+    parser.add_argument(
+        "--cachesize",
+        help="Largest size of the cache (in megabytes). (Default 1024)",
+        type=float,
+    )
+    parser.add_argument(
+        "--cacheage",
+        help="Remove cache entries that haven't been used for this many days. (Default 30)",
+        type=float,
+    )
+
+    # Interpreter statistics
+    parser.add_argument(
+        "--opcodestats",
+        help="Count and time each Gerber command and print a table of them at the end.",
+        action="store_true",
+    )
+
+    # Metrics
+    modes.add_argument(
+        "--metrics",
+        help="Instead of converting the files, write their metrics to this file as JSON, as CSV if it ends in .csv, or to the terminal with -: bounding box, mark and cut lengths, travel with the tool up, tool changes, drill hits per pattern and estimated machine time.",
+    )
+
+    # Instrumentation
+    parser.add_argument(
+        "--stats",
+        help="Write a JSON summary of the run to this file, or to the terminal with -: counts of tokens, paths, vertices, drills and bytes, and the time spent reading, tokenizing, interpreting and writing. Batches are converted in one process.",
+    )
+    parser.add_argument(
+        "--tracememory",
+        help="Add the peak memory of each stage to --stats. Makes the run much slower.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the run with cProfile and save the profile to this file.",
+    )
+
     # Verbose flag
     parser.add_argument(
         "-v", "--verbose", help="Display progress to terminal.", action="store_true"
@@ -44,38 +251,144 @@ def build_arg_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def gerber_tokenizer(input_string: str) -> Iterator[Token]:
-    commands = re.findall(r"([A-W,Z/]\d*|X-?\d+Y-?\d+)", input_string)
-    for cmd in commands:
-        if cmd.startswith("X"):
-            x, y = map(int, re.findall(r"-?\d+", cmd))
-            yield Token.from_coordinate(x, y)
-        else:
-            yield Token.from_command(cmd[0], int(cmd[1:]))
+def check_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    # Reject options that would be ignored with the others given.
+    mode = next((name for name in MODE_OPTIONS if getattr(args, name)), None)
+    if mode is not None:
+        for name in ("cache", "stats"):
+            if getattr(args, name):
+                parser.error(f"argument --{name}: not allowed with argument --{mode}")
+    if args.reversepaths and not args.optimize:
+        parser.error("argument --reversepaths: only allowed with argument --optimize")
+
+
+def options_from_args(
+    args: argparse.Namespace, file_options: dict
+) -> ConversionOptions:
+    # Command line options take precedence over the ones in gerber_to_igor.toml.
+    values = {}
+    for field in dataclasses.fields(ConversionOptions):
+        value = getattr(args, field.name) or file_options.get(field.name)
+        if value is not None:
+            values[field.name] = value
+    return ConversionOptions(**values)
 
 
 if __name__ == "__main__":
-    file_options = {}
-    if os.path.exists("gerber_to_igor.toml"):
-        with open("gerber_to_igor.toml", "rb") as f:
-            file_options = tomllib.load(f)
+    file_options = load_config()
 
     parser = build_arg_parser()
     args = parser.parse_args()
-
-    gerber = Gerber(
-        args.gerberfile,
-        args.units or file_options.get("units", 2),
-        args.cutoffset or file_options.get("cutoffset", "0,0"),
-        args.markoffset or file_options.get("markoffset", "0,0"),
-        args.drilloffset or file_options.get("drilloffset", "0,0"),
-        args.verbose or file_options.get("verbose", False),
+    check_args(parser, args)
+    options = options_from_args(args, file_options)
+    logging.basicConfig(
+        format="%(message)s", level=logging.DEBUG if options.verbose else logging.INFO
     )
 
-    with open(args.gerberfile, "r") as gerber_file:
-        for token in gerber_tokenizer(gerber_file.read()):
-            should_stop = gerber.command(token)
-            if should_stop:
-                break
+    cache = None
+    cache_directory = args.cache or file_options.get("cache")
+    if cache_directory:
+        cache_size = args.cachesize or file_options.get("cachesize", 1024)
+        cache = ConversionCache(
+            cache_directory,
+            round(cache_size * 1024 * 1024),
+            args.cacheage or file_options.get("cacheage", DEFAULT_MAX_AGE_DAYS),
+        )
+
+    run_stats = RunStats(args.tracememory) if args.stats else None
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    file_names, unmatched = batch.expand_inputs(args.gerberfile)
+    for name in unmatched:
+        print(f"No files match {name}", file=sys.stderr)
+    failed = bool(unmatched)
+    if args.watch:
+        try:
+            watch.watch(
+                file_names, options, args.workers or file_options.get("workers")
+            )
+        except KeyboardInterrupt:
+            pass
+    elif args.metrics:
+        results = list(
+            metrics.measure_batch(
+                file_names,
+                options,
+                args.workers or file_options.get("workers"),
+                metrics.MachineSpeeds(**file_options.get("speeds", {})),
+            )
+        )
+        metrics.write_results(results, args.metrics)
+        failed |= any("error" in result for result in results)
+    elif args.patterns:
+        for file_name in file_names:
+            index_name = patterns.convert_patterns(
+                file_name, options, args.workers or file_options.get("workers")
+            )
+            if options.verbose:
+                print(f"{file_name}: {index_name}")
+    elif args.optimize:
+        for file_name in file_names:
+            output_names, before, after = optimize.optimize_file(
+                file_name, options, args.reversepaths
+            )
+            print(f"{file_name}: travel {before:.4f} in -> {after:.4f} in")
+            if options.verbose:
+                print(f"{file_name}: {', '.join(output_names)}")
+    elif args.window:
+        for file_name in file_names:
+            for output_name in convert_windows(file_name, options, args.window):
+                if options.verbose:
+                    print(f"{file_name}: {output_name}")
+    elif args.sweep:
+        for file_name in file_names:
+            for output_name in convert_sweep(file_name, options, args.sweep):
+                if options.verbose:
+                    print(f"{file_name}: {output_name}")
+    elif len(file_names) == 1 and file_names[0] == args.gerberfile[0]:
+        convert_file(file_names[0], options, cache, run_stats)
+    else:
+        start = time.perf_counter()
+        results = []
+        for result in batch.convert_batch(
+            file_names,
+            options,
+            args.workers or file_options.get("workers"),
+            cache,
+            run_stats,
+        ):
+            if options.verbose:
+                outputs = result.error or ", ".join(result.output_names)
+                print(f"{result.file_name}: {outputs}")
+            results.append(result)
+        batch.print_summary(results, time.perf_counter() - start)
+        failed |= any(result.error is not None for result in results)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    if run_stats is not None:
+        summary = json.dumps(run_stats.summary(), indent=2)
+        run_stats.close()
+        if args.stats == "-":
+            print(summary)
+        else:
+            with open(args.stats, "w") as f:
+                f.write(summary + "\n")
+
+    if cache is not None:
+        cache.evict()
+        cache_stats = cache.save_stats()
+        if options.verbose:
+            print(
+                f"Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses,"
+                f" {cache_stats['evictions']} evictions,"
+                f" {cache_stats['entries']} entries,"
+                f" {cache_stats['bytes'] / 1e6:.1f} MB"
+            )
 
-    gerber.finish()
+    if failed:
+        sys.exit(1)
@@ -1,7 +1,15 @@
-from typing import Self
+from array import array
+from typing import Iterator, Self
+
+# Code stored in a TokenBatch for coordinates, and the value stored for commands
+# without a number.
+COORDINATE_CODE = ord("X")
+NO_VALUE = -1
 
 
 class Token:
+    __slots__ = ("code", "value", "x", "y", "is_coordinate")
+
     code: str
     value: int
     x: int
@@ -36,3 +44,48 @@ class Token:
             return f"{self.code}{self.value}"
         else:
             return self.code
+
+
+class TokenBatch:
+    # A run of tokens stored as parallel arrays rather than one Token per command.
+    # codes holds the character code of each command (COORDINATE_CODE for coordinates),
+    # values holds the command number (NO_VALUE if there isn't one) and xs and ys hold
+    # the coordinates.
+    __slots__ = ("codes", "values", "xs", "ys")
+
+    codes: array
+    values: array
+    xs: array
+    ys: array
+
+    @staticmethod
+    def from_matches(matches: list[tuple]) -> Self:
+        # Build a batch from the (code, digits, x, y) groups of tokenizer matches.
+        batch = TokenBatch()
+        batch.codes = array(
+            "B", [ord(code) if code else COORDINATE_CODE for code, _, _, _ in matches]
+        )
+        batch.values = array(
+            "i", [int(digits) if digits else NO_VALUE for _, digits, _, _ in matches]
+        )
+        batch.xs = array("i", [int(x) if x else 0 for _, _, x, _ in matches])
+        batch.ys = array("i", [int(y) if y else 0 for _, _, _, y in matches])
+        return batch
+
+    def __init__(self):
+        self.codes = array("B")
+        self.values = array("i")
+        self.xs = array("i")
+        self.ys = array("i")
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __iter__(self) -> Iterator[Token]:
+        for code, value, x, y in zip(self.codes, self.values, self.xs, self.ys):
+            if code == COORDINATE_CODE:
+                yield Token.from_coordinate(x, y)
+            else:
+                yield Token.from_command(
+                    chr(code), None if value == NO_VALUE else value
+                )
@@ -0,0 +1,73 @@
+from typing import TextIO
+
+from gerber_token import NO_VALUE
+from point import Tool, Units
+from toolpath import DRILL, FILE, ORIGIN, PATH, PATTERN, RETURN, SPEED, STOP, Toolpath
+
+# Commands that set the units, and the commands that put each tool down and lift it.
+UNITS_COMMANDS = {
+    Units.THOUSANDTHS: "G70",
+    Units.TENTHS: "G71",
+    Units.HUNDREDTHS: "G91",
+}
+TOOL_COMMANDS = {Tool.MARK: ("D1", "D2"), Tool.CUT: ("M14", "M15")}
+
+
+class GerberWriter:
+    # Writes Gerber commands for locations in counts, switching to units that can
+    # give each location exactly.
+    out: TextIO
+    units: Units | None
+
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.units = None
+
+    def units_for(self, x: int, y: int) -> Units:
+        # Keep the current units when they can give the location, to avoid
+        # switching back and forth.
+        for units in (self.units, Units.THOUSANDTHS, Units.HUNDREDTHS, Units.TENTHS):
+            if units is None:
+                continue
+            if not (x % units.counts or y % units.counts):
+                return units
+        raise ValueError(f"({x}, {y}) can't be given in any units.")
+
+    def coordinate(self, x: int, y: int) -> str:
+        units = self.units_for(x, y)
+        text = f"X{x // units.counts}Y{y // units.counts}*"
+        if units != self.units:
+            text = f"{UNITS_COMMANDS[units]}*" + text
+            self.units = units
+        return text
+
+    def write_line(self, text: str) -> None:
+        self.out.write(text + "\n")
+
+
+def write_gerber(toolpath: Toolpath, out: TextIO) -> None:
+    # Write Gerber commands that make the toolpath. Every vertex is given as a
+    # coordinate, origins are set and returned to where the toolpath does, and each
+    # pattern ends with M0 where the toolpath has a STOP.
+    writer = GerberWriter(out)
+    for kind, first, second, path in toolpath.records():
+        if kind == PATH:
+            down, up = TOOL_COMMANDS[Tool(first)]
+            coordinates = [writer.coordinate(x, y) for x, y in path]
+            writer.write_line(
+                coordinates[0] + f"{down}*" + "".join(coordinates[1:]) + f"{up}*"
+            )
+        elif kind == DRILL:
+            writer.write_line(writer.coordinate(first, second) + "M43*")
+        elif kind == ORIGIN:
+            writer.write_line(writer.coordinate(first, second) + "G4*")
+        elif kind == FILE:
+            writer.write_line("H*" if first == NO_VALUE else f"H{first}*")
+        elif kind == PATTERN:
+            writer.write_line("N*" if first == NO_VALUE else f"N{first}*")
+        elif kind == RETURN:
+            writer.write_line("M70*")
+        elif kind == SPEED:
+            writer.write_line("M26*")
+        elif kind == STOP:
+            writer.write_line("M0*")
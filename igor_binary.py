@@ -0,0 +1,219 @@
+import io
+import re
+import struct
+from array import array
+from typing import IO, Sequence
+
+from background_writer import BackgroundWriter
+from drill_glyph import DrillGlyph
+from igor_writer import Igor
+from point import COUNTS_PER_INCH, DEFAULT_PRECISION, Point
+from spatial_index import Window
+
+# Packed experiment record types (Igor Technical Note PTN003).
+WAVE_RECORD = 3
+PROCEDURE_RECORD = 5
+
+# Igor wave data types (Igor Technical Note TN003).
+NUMBER_TYPES = {
+    "f": 2,  # NT_FP32
+    "d": 4,  # NT_FP64
+    "i": 0x20,  # NT_I32
+    "I": 0x20 | 0x40,  # NT_I32 | NT_UNSIGNED
+}
+
+# Layouts of the BinHeader5 and WaveHeader5 structures of an Igor binary wave,
+# version 5. The wave data follows immediately after the two headers.
+BIN_HEADER_5 = struct.Struct("<hh15l")
+WAVE_HEADER_5 = struct.Struct("<lLLlhh6sh32sll4l4d4d4s16shhddl4l4ll16lhhhbbllhhll")
+
+PACKED_RECORD_HEADER = struct.Struct("<Hhl")
+
+# Copies the shapes to the path waves as listed in the placements wave, which has a
+# row of shape number, path number, x and y (in inches) for each path.
+EXPAND_SHAPES_FUNCTION = [
+    "Function ExpandShapes()",
+    "\tWave placements",
+    "\tVariable i",
+    "\tString shape, number",
+    "\tfor (i = 0; i < DimSize(placements, 0); i += 1)",
+    "\t\tshape = num2istr(placements[i][0])",
+    "\t\tnumber = num2istr(placements[i][1])",
+    '\t\tDuplicate/O $("shape" + shape), $("path" + number)',
+    '\t\tWave copy = $("path" + number)',
+    "\t\tcopy[][0] += placements[i][2]",
+    "\t\tcopy[][1] += placements[i][3]",
+    '\t\tDuplicate/O $("shapeMarkerNumber" + shape), $("markerNumber" + number)',
+    '\t\tDuplicate/O $("shapeMarkerSize" + shape), $("markerSize" + number)',
+    '\t\tDuplicate/O $("shapeColorIndex" + shape), $("colorIndex" + number)',
+    "\tendfor",
+    "End",
+]
+
+MAX_WAVE_NAME_LENGTH = 31
+
+
+def binary_wave(name: str, data: array, dimensions: Sequence[int]) -> bytes:
+    # Return an Igor binary wave (version 5) holding data, which is stored in column
+    # major order like Igor does.
+    data_bytes = data.tobytes()
+    nDim = list(dimensions) + [0] * (4 - len(dimensions))
+    wave_header = WAVE_HEADER_5.pack(
+        0,  # next
+        0,  # creationDate
+        0,  # modDate
+        len(data),  # npnts
+        NUMBER_TYPES[data.typecode],  # type
+        0,  # dLock
+        b"",  # whpad1
+        1,  # whVersion
+        name.encode("ascii"),  # bname
+        0,  # whpad2
+        0,  # dFolder
+        *nDim,
+        *[1.0] * 4,  # sfA
+        *[0.0] * 4,  # sfB
+        b"",  # dataUnits
+        b"",  # dimUnits
+        0,  # fsValid
+        0,  # whpad3
+        0.0,  # topFullScale
+        0.0,  # botFullScale
+        0,  # dataEUnits
+        *[0] * 4,  # dimEUnits
+        *[0] * 4,  # dimLabels
+        0,  # waveNoteH
+        *[0] * 16,  # whUnused
+        0,  # aModified
+        0,  # wModified
+        0,  # swModified
+        0,  # useBits
+        0,  # kindBits
+        0,  # formula
+        0,  # depID
+        0,  # whpad4
+        0,  # srcFldr
+        0,  # fileName
+        0,  # sIndices
+    )
+    wfm_size = WAVE_HEADER_5.size + len(data_bytes)
+    bin_header = BIN_HEADER_5.pack(5, 0, wfm_size, *[0] * 14)
+
+    # The checksum makes the 16 bit sum of both headers zero.
+    total = sum(array("h", bin_header + wave_header)) & 0xFFFF
+    checksum = -total & 0xFFFF
+    checksum -= 0x10000 if checksum & 0x8000 else 0
+    bin_header = BIN_HEADER_5.pack(5, checksum, wfm_size, *[0] * 14)
+
+    return bin_header + wave_header + data_bytes
+
+
+class IgorBinary(Igor):
+    # Writes the same waves as Igor, but as binary waves in an Igor packed experiment.
+    # The commands that build the graph go into a macro in the experiment's procedure
+    # window, which shows up in Igor's Macros menu. With instances, the paths that
+    # are copies of shapes are listed in a placements wave, one column per array in
+    # placements, and the macro copies them with ExpandShapes.
+    output_file: io.BufferedWriter | BackgroundWriter | IO
+    macro_name: str
+    commands: list[str]
+    placements: list[array]
+
+    def __init__(
+        self,
+        fileName: str,
+        precision: int = DEFAULT_PRECISION,
+        merge: bool = False,
+        drill_glyph: DrillGlyph | None = None,
+        batch_drills: bool = False,
+        background_writes: bool = False,
+        stream: IO | None = None,
+        axis_window: Window | None = None,
+        instances: bool = False,
+    ):
+        self.commands = []
+        self.placements = [array("d") for _ in range(4)]
+        super().__init__(
+            fileName,
+            precision,
+            merge,
+            drill_glyph,
+            batch_drills,
+            background_writes,
+            stream,
+            axis_window,
+            instances,
+        )
+
+    def open_output(self, fileName: str):
+        self.file_name = fileName
+        if self.stream is not None:
+            self.output_file = self.stream
+        else:
+            self.output_file = open(fileName, "wb")
+            if self.background_writes:
+                self.output_file = BackgroundWriter(self.output_file)
+
+    def close_output(self):
+        if self.placements[0]:
+            data = array("d")
+            for column in self.placements:
+                data.extend(column)
+            self.write_binary_wave("placements", data, (len(self.placements[0]), 4))
+        self.write_procedure()
+        self.release_output()
+
+    def write_record(self, record_type: int, data: bytes):
+        self.output_file.write(PACKED_RECORD_HEADER.pack(record_type, 0, len(data)))
+        self.output_file.write(data)
+
+    def write_procedure(self):
+        lines = [
+            "#pragma rtGlobals=1",
+            "",
+            f"Macro Make{self.graph_name}()",
+            "\tPauseUpdate; Silent 1",
+            *(["\tExpandShapes()"] if self.placements[0] else []),
+            *["\t" + command for command in self.commands],
+            "EndMacro",
+            "",
+        ]
+        if self.placements[0]:
+            lines += [*EXPAND_SHAPES_FUNCTION, ""]
+        self.write_record(PROCEDURE_RECORD, "\r".join(lines).encode("ascii"))
+
+    def write_command(self, command: str):
+        self.commands.append(command)
+
+    def place_shape(self, shape: int, wave_number: int, location: Point):
+        row = (
+            shape,
+            wave_number,
+            location.x / COUNTS_PER_INCH,
+            location.y / COUNTS_PER_INCH,
+        )
+        for column, value in zip(self.placements, row):
+            column.append(value)
+
+    def write_binary_wave(self, name: str, data: array, dimensions: Sequence[int]):
+        if len(name) > MAX_WAVE_NAME_LENGTH or not re.fullmatch(r"\w+", name):
+            raise ValueError(f"{name} can't be used as an Igor wave name.")
+        self.write_record(WAVE_RECORD, binary_wave(name, data, dimensions))
+
+    def write_xy_wave(self, name: str, xs: Sequence[float], ys: Sequence[float]):
+        data = array("d", xs)
+        data.extend(ys)
+        self.write_binary_wave(name, data, (len(xs), 2))
+
+    def write_runs_wave(
+        self, name: str, runs: list[tuple[int, int]], flags: str = "/O"
+    ):
+        data = array("I" if "/U" in flags else "i")
+        for value, count in runs:
+            data.extend(array(data.typecode, [value]) * count)
+        self.write_binary_wave(name, data, (len(data),))
+
+    def write_matrix_wave(self, name: str, rows: list[tuple[int, ...]]):
+        # Igor stores matrices a column at a time.
+        data = array("i", [value for column in zip(*rows) for value in column])
+        self.write_binary_wave(name, data, (len(rows), len(rows[0])))
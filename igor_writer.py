@@ -1,7 +1,27 @@
 import io
 import math
+import os
+from array import array
+from operator import sub
+from typing import IO, Sequence
 
-from point import Point
+from backend import Backend
+from background_writer import BackgroundWriter
+from drill_glyph import DrillGlyph, get_drill_glyph
+from path_buffer import PathBuffer
+from point import COUNTS_PER_INCH, DEFAULT_PRECISION, Point, Tool
+from spatial_index import Window
+
+# Names given to the merged wave of each tool, indexed by tool number.
+MERGED_WAVE_PREFIXES = ["mark", "cut", "drill"]
+DRILL_TOOL = 2
+
+# Index into plotColors for drills.
+DRILL_COLOR_INDEX = 4
+
+# With instances, paths with fewer points than this are written out in full, since
+# the command that places a shape is longer than their waves.
+MIN_INSTANCE_POINTS = 4
 
 
 class MyTextIOWrapper:
@@ -18,11 +38,19 @@ class MyTextIOWrapper:
         return self.wrapper.write(text)
 
 
-class Igor:
+class Igor(Backend):
+    # Bounds of everything plotted, in inches.
     min_x: float
     max_x: float
     min_y: float
     max_y: float
+    # With axis_window the axes show that region instead of fitting the bounds.
+    axis_window: Window | None
+
+    # Coordinates are written in inches with this many decimal places.
+    precision: int
+    number_format: str
+    row_format: str
 
     wave_number: int
     first_wave_graphed: bool
@@ -30,14 +58,60 @@ class Igor:
 
     graph_name: str
 
-    output_file: io.TextIOWrapper
+    # In merge mode every path for a tool goes into one wave, with a row of NaN
+    # after each path. path_starts holds (tool, first row, rows) for every path
+    # in the order they were plotted.
+    merge: bool
+    merged_xs: list[array]
+    merged_ys: list[array]
+    path_starts: array
+
+    drill_glyph: DrillGlyph
+
+    # With batch_drills, drill hits are held in pending_drills until the end of the
+    # pattern and then written as one wave.
+    batch_drills: bool
+    pending_drills: list[Point]
+
+    # With instances, each distinct path shape is written once as shapeN, with its
+    # vertices relative to its first vertex, and every path with that shape and tool
+    # is a command that copies the shape waves to the path's waves and moves the copy
+    # into place. shapes holds the number of each shape by tool and the differences
+    # between successive vertices.
+    instances: bool
+    shapes: dict[tuple[int, bytes, bytes], int]
+
+    # With background_writes the output is written by a BackgroundWriter, so
+    # formatting carries on while the disk is busy.
+    background_writes: bool
+    # With a stream the output is written to it rather than to file_name, and the
+    # stream is left open so the caller can read it.
+    stream: IO | None
+    file_name: str
+    output_file: io.TextIOWrapper | BackgroundWriter | IO
     file: MyTextIOWrapper
 
-    def __init__(self, fileName: str):
+    def __init__(
+        self,
+        fileName: str,
+        precision: int = DEFAULT_PRECISION,
+        merge: bool = False,
+        drill_glyph: DrillGlyph | None = None,
+        batch_drills: bool = False,
+        background_writes: bool = False,
+        stream: IO | None = None,
+        axis_window: Window | None = None,
+        instances: bool = False,
+    ):
+        self.precision = precision
+        self.number_format = f"{{:.{precision}f}}"
+        self.row_format = f"\t{{:.{precision}f}}\t{{:.{precision}f}}\n"
+
         self.min_x = float("inf")
         self.max_x = -float("inf")
         self.min_y = float("inf")
         self.max_y = -float("inf")
+        self.axis_window = axis_window
 
         self.wave_number = 0
         self.first_wave_graphed = False
@@ -45,242 +119,449 @@ class Igor:
 
         self.graph_name = "GerberPlot0"
 
-        self.output_file = open(fileName, "w")
-        self.file = MyTextIOWrapper(self.output_file)
+        self.merge = merge
+        self.merged_xs = [array("d") for _ in MERGED_WAVE_PREFIXES]
+        self.merged_ys = [array("d") for _ in MERGED_WAVE_PREFIXES]
+        self.path_starts = array("i")
+
+        self.drill_glyph = drill_glyph or get_drill_glyph()
+        self.batch_drills = batch_drills
+        self.pending_drills = []
+
+        self.instances = instances and not merge
+        self.shapes = {}
+
+        self.background_writes = background_writes
+        self.stream = stream
+        self.open_output(fileName)
+        self.write_command(f"Display /W=(35,45,1797,1294) /N={self.graph_name}")
+        self.write_matrix_wave(
+            "plotColors",
+            [
+                (0, 65535, 0),
+                (65535, 0, 0),
+                (48545, 4000, 32768),
+                (24000, 24000, 65535),
+                (32768, 48545, 4000),
+            ],
+        )
+
+        self.write_matrix_wave(
+            "markerColors",
+            [
+                (16385, 65535, 36045, 32768),
+                (65535, 16385, 36045, 32768),
+                (65535, 20000, 48535, 32768),
+                # The fourth color is for notches which don't use markers so it's just black
+                (0, 0, 0, 65535),
+            ],
+        )
+
+        self.write_command("Variable/G logWaveQuantity=10")
 
+    def open_output(self, fileName: str):
+        self.file_name = fileName
+        if self.stream is not None:
+            self.output_file = self.stream
+        else:
+            self.output_file = open(fileName, "w")
+            if self.background_writes:
+                self.output_file = BackgroundWriter(self.output_file)
+        self.file = MyTextIOWrapper(self.output_file)
         self.file.write_line("IGOR")
-        self.file.write_line(f"X Display /W=(35,45,1797,1294) /N={self.graph_name}")
-        self.file.write_line("WAVES/O/N=(5,3) plotColors")
-        self.file.write_line("BEGIN")
-        self.file.write_line("\t0\t65535\t0")
-        self.file.write_line("\t65535\t0\t0")
-        self.file.write_line("\t48545\t4000\t32768")
-        self.file.write_line("\t24000\t24000\t65535")
-        self.file.write_line("\t32768\t48545\t4000")
-        self.file.write_line("END")
-
-        self.file.write_line("WAVES/O/N=(4,4) markerColors")
-        self.file.write_line("BEGIN")
-        self.file.write_line("\t16385\t65535\t36045\t32768")
-        self.file.write_line("\t65535\t16385\t36045\t32768")
-        self.file.write_line("\t65535\t20000\t48535\t32768")
-        # The fourth color is for notches which don't use markers so it's just black
-        self.file.write_line("\t0\t0\t0\t65535")
-        self.file.write_line("END")
-
-        self.file.write_line("X Variable/G logWaveQuantity=10")
 
-    def finish(self):
-        if math.isnan(self.max_x):
+    def release_output(self):
+        if self.stream is None:
             self.output_file.close()
+
+    def close_output(self):
+        self.release_output()
+
+    def abort(self):
+        # Stop without finishing and remove the partial output.
+        self.release_output()
+        if self.stream is None:
+            os.remove(self.file_name)
+
+    def format(self, inches: float) -> str:
+        return self.number_format.format(inches)
+
+    def write_command(self, command: str):
+        self.file.write_line("X " + command)
+
+    def write_wave(self, declaration: str, body: str):
+        # Write a whole wave, declaration to END, in one call.
+        self.file.write(f"{declaration}\nBEGIN\n{body}END\n")
+
+    def write_xy_wave(self, name: str, xs: Sequence[float], ys: Sequence[float]):
+        # Write an (n, 2) wave of coordinates in inches. NaN breaks the line.
+        body = "".join(map(self.row_format.format, xs, ys)).replace("nan", "NaN")
+        self.write_wave(f"WAVES/O/N=({len(xs)}, 2) {name}", body)
+
+    def write_runs_wave(
+        self, name: str, runs: list[tuple[int, int]], flags: str = "/O"
+    ):
+        # Write a one dimensional wave given as runs of (value, count).
+        body = "".join([f"\t{value}\n" * count for value, count in runs])
+        self.write_wave(f"WAVES{flags} {name}", body)
+
+    def write_matrix_wave(self, name: str, rows: list[tuple[int, ...]]):
+        body = "".join(["\t" + "\t".join(map(str, row)) + "\n" for row in rows])
+        self.write_wave(f"WAVES/O/N=({len(rows)},{len(rows[0])}) {name}", body)
+
+    def path_inches(self, path: PathBuffer) -> tuple[list[float], list[float]]:
+        return (
+            [x / COUNTS_PER_INCH for x in path.xs],
+            [y / COUNTS_PER_INCH for y in path.ys],
+        )
+
+    def finish(self):
+        self.end_pattern()
+        if math.isinf(self.max_x):
+            self.close_output()
             return
 
-        self.first_wave_in_graph.append(self.wave_number + 1)
-        self.file.write_line("WAVES/O firstWaveNumber")
-        self.file.write_line("BEGIN")
-        for wave_number in self.first_wave_in_graph:
-            self.file.write_line(f"\t{wave_number}")
-        self.file.write_line("END")
-
-        x_buffer = abs(self.max_x - self.min_x) / 40.0
-        y_buffer = abs(self.max_y - self.min_y) / 40.0
-        self.file.write_line(
-            f"X SetAxis left {self.min_y - y_buffer}, {self.max_y + y_buffer}"
+        if self.merge:
+            self.write_merged_waves()
+        else:
+            self.first_wave_in_graph.append(self.wave_number + 1)
+            self.write_runs_wave(
+                "firstWaveNumber", [(number, 1) for number in self.first_wave_in_graph]
+            )
+
+        if self.axis_window is not None:
+            bottom = self.format(self.axis_window.min_y / COUNTS_PER_INCH)
+            top = self.format(self.axis_window.max_y / COUNTS_PER_INCH)
+            left = self.format(self.axis_window.min_x / COUNTS_PER_INCH)
+            right = self.format(self.axis_window.max_x / COUNTS_PER_INCH)
+        else:
+            x_buffer = abs(self.max_x - self.min_x) / 40.0
+            y_buffer = abs(self.max_y - self.min_y) / 40.0
+            bottom = self.format(self.min_y - y_buffer)
+            top = self.format(self.max_y + y_buffer)
+            left = self.format(self.min_x - x_buffer)
+            right = self.format(self.max_x + x_buffer)
+        self.write_command(f"SetAxis left {bottom}, {top}")
+        self.write_command(f"SetAxis bottom {left}, {right}")
+        self.write_command("ModifyGraph axisEnab(left)={0,0.95}")
+
+        # Add the Next and All buttons, which step through the pathN waves. Merge
+        # mode graphs every path at once, so it has nothing to step through.
+        if not self.merge:
+            self.write_command(
+                'Button addWaveButton, pos={5.00,5.00}, size={50.00,20.00}, proc=LogWaveButton, title="Next", userdata="Add"'
+            )
+            self.write_command(
+                'Button addAllWavesButton, pos={60.00,5.00}, size={50.00,20.00}, proc=LogWaveButton, title="All", userData="All"'
+            )
+            self.write_command(
+                'Button removeButton, pos={115.00,5.00}, size={70.00,20.00}, proc=LogWaveButton, title="Remove", userdata="Remove"'
+            )
+            self.write_command(
+                'Button addNWavesButton, pos={190.00,5.00}, size={56.00,20.00}, proc=LogWaveButton, title="Next n", userdata="AddN"'
+            )
+            self.write_command(
+                'Button removeNWavesButton, pos={251.00,5.00}, size={78.00,20.00}, proc=LogWaveButton, title="Remove n", userdata="RemoveN"'
+            )
+            self.write_command(
+                'SetVariable logWaveQuantityControl pos={334.00,5.00}, size={60,20}, value=logWaveQuantity, limits={1,inf,1}, fSize = 12, title="n:"'
+            )
+
+        self.write_command(
+            'SetVariable lastStartXDisplay,pos={5.00,26.00},size={120.00,17.00},title="Last start:"'
         )
-        self.file.write_line(
-            f"X SetAxis bottom {self.min_x - x_buffer}, {self.max_x + x_buffer}"
+        self.write_command("SetVariable lastStartXDisplay,fSize=12,frame=0")
+        self.write_command(
+            "SetVariable lastStartXDisplay,limits={-inf,inf,0},value=lastPathEnds[0][0],noedit= 1"
         )
-        self.file.write_line("X ModifyGraph axisEnab(left)={0,0.95}")
-
-        # Add the Next and All buttons.
-        self.file.write_line(
-            'X Button addWaveButton, pos={5.00,5.00}, size={50.00,20.00}, proc=LogWaveButton, title="Next", userdata="Add"'
+        self.write_command(
+            "SetVariable lastStartYDisplay,pos={124.00,26.00},size={120.00,17.00}"
         )
-        self.file.write_line(
-            'X Button addAllWavesButton, pos={60.00,5.00}, size={50.00,20.00}, proc=LogWaveButton, title="All", userData="All"'
+        self.write_command("SetVariable lastStartYDisplay,fSize=12,frame=0")
+        self.write_command(
+            'SetVariable lastStartYDisplay,limits={-inf,inf,0},value=lastPathEnds[0][1],noedit= 1,title=" "'
         )
-        self.file.write_line(
-            'X Button removeButton, pos={115.00,5.00}, size={70.00,20.00}, proc=LogWaveButton, title="Remove", userdata="Remove"'
+
+        self.write_command(
+            'SetVariable lastEndXDisplay,pos={5.00,42.00},size={120.00,17.00},title="Last end:"'
         )
-        self.file.write_line(
-            'X Button addNWavesButton, pos={190.00,5.00}, size={56.00,20.00}, proc=LogWaveButton, title="Next n", userdata="AddN"'
+        self.write_command("SetVariable lastEndXDisplay,fSize=12,frame=0")
+        self.write_command(
+            "SetVariable lastEndXDisplay,limits={-inf,inf,0},value=lastPathEnds[1][0],noedit= 1"
         )
-        self.file.write_line(
-            'X Button removeNWavesButton, pos={251.00,5.00}, size={78.00,20.00}, proc=LogWaveButton, title="Remove n", userdata="RemoveN"'
+        self.write_command(
+            "SetVariable lastEndYDisplay,pos={124.00,42.00},size={120.00,17.00}"
         )
-        self.file.write_line(
-            'X SetVariable logWaveQuantityControl pos={334.00,5.00}, size={60,20}, value=logWaveQuantity, limits={1,inf,1}, fSize = 12, title="n:"'
+        self.write_command("SetVariable lastEndYDisplay,fSize=12,frame=0")
+        self.write_command(
+            'SetVariable lastEndYDisplay,limits={-inf,inf,0},value=lastPathEnds[1][1],noedit= 1,title=" "'
         )
 
-        self.file.write_line(
-            'X SetVariable lastStartXDisplay,pos={5.00,26.00},size={120.00,17.00},title="Last start:"'
+        self.write_command(
+            'CheckBox showEndsCheckBox,pos={5.00,63.00},size={48.00,16.00},proc=ShowEndsCheckProc,title="Show"'
+        )
+        self.write_command("CheckBox showEndsCheckBox,fSize=12,value= 0")
+
+        self.close_output()
+
+    def write_last_ends_wave(self, start: Point, end: Point):
+        self.write_xy_wave(
+            "lastPathEnds",
+            [start.x / COUNTS_PER_INCH, end.x / COUNTS_PER_INCH],
+            [start.y / COUNTS_PER_INCH, end.y / COUNTS_PER_INCH],
         )
-        self.file.write_line("X SetVariable lastStartXDisplay,fSize=12,frame=0")
-        self.file.write_line(
-            "X SetVariable lastStartXDisplay,limits={-inf,inf,0},value=lastPathEnds[0][0],noedit= 1"
+        self.write_matrix_wave("lastPathEndColors", [(0, 35050, 0), (35050, 0, 0)])
+        self.write_runs_wave("lastPathEndMarkers", [(18, 1), (55, 1)], "/I/U")
+
+    def update_bounds(self, xs: Sequence[float], ys: Sequence[float]):
+        self.min_x = min(self.min_x, min(xs))
+        self.max_x = max(self.max_x, max(xs))
+        self.min_y = min(self.min_y, min(ys))
+        self.max_y = max(self.max_y, max(ys))
+
+    def append_path_to_graph(
+        self,
+        tool: int,
+        wave_name: str,
+        marker_number_wave_name: str,
+        marker_size_wave_name: str,
+        color_index_wave_name: str,
+    ):
+        marker_color = (
+            "16385,65535,36045,32768" if tool == 0 else "65535,16385,36045,32768"
         )
-        self.file.write_line(
-            "X SetVariable lastStartYDisplay,pos={124.00,26.00},size={120.00,17.00}"
+        self.write_command(
+            f"AppendToGraph /W={self.graph_name} {wave_name}[*][1] vs {wave_name}[*][0]"
         )
-        self.file.write_line("X SetVariable lastStartYDisplay,fSize=12,frame=0")
-        self.file.write_line(
-            'X SetVariable lastStartYDisplay,limits={-inf,inf,0},value=lastPathEnds[0][1],noedit= 1,title=" "'
+        self.write_command(
+            # Index into tool color wave.
+            f"ModifyGraph zColor({wave_name})={{{color_index_wave_name},*,*,cindexRGB,0,plotColors}}"
+            # Marker specifications.
+            f", zmrkNum({wave_name})={{{marker_number_wave_name}}}, mrkThick({wave_name})=2"
+            f", useMrkStrokeRGB({wave_name})=1, mrkStrokeRGB({wave_name})=({marker_color}), mode({wave_name})=4"
+            f", zmrkSize({wave_name})={{{marker_size_wave_name},3,8,3,8}}"
         )
 
-        self.file.write_line(
-            'X SetVariable lastEndXDisplay,pos={5.00,42.00},size={120.00,17.00},title="Last end:"'
+    def append_drill_to_graph(self, wave_name: str, color_index_wave_name: str):
+        self.write_command(
+            f"AppendToGraph /W={self.graph_name} {wave_name}[*][1] vs {wave_name}[*][0]"
         )
-        self.file.write_line("X SetVariable lastEndXDisplay,fSize=12,frame=0")
-        self.file.write_line(
-            "X SetVariable lastEndXDisplay,limits={-inf,inf,0},value=lastPathEnds[1][0],noedit= 1"
+        # Index into tool color wave
+        self.write_command(
+            f"ModifyGraph zColor({wave_name})={{{color_index_wave_name},*,*,cindexRGB,0,plotColors}}"
+        )
+
+    def merge_path(self, tool: int, xs: Sequence[float], ys: Sequence[float]):
+        merged_xs = self.merged_xs[tool]
+        merged_ys = self.merged_ys[tool]
+        self.path_starts.extend((tool, len(merged_xs), len(xs)))
+        merged_xs.extend(xs)
+        merged_ys.extend(ys)
+        merged_xs.append(math.nan)
+        merged_ys.append(math.nan)
+
+    def write_merged_waves(self):
+        starts = list(zip(*[iter(self.path_starts)] * 3))
+        for tool, prefix in enumerate(MERGED_WAVE_PREFIXES):
+            xs = self.merged_xs[tool]
+            if not xs:
+                continue
+            rows = len(xs)
+            wave_name = f"{prefix}Path"
+            color_index_wave_name = f"{prefix}ColorIndex"
+            self.write_xy_wave(wave_name, xs, self.merged_ys[tool])
+
+            if tool == DRILL_TOOL:
+                self.write_runs_wave(color_index_wave_name, [(DRILL_COLOR_INDEX, rows)])
+                self.append_drill_to_graph(wave_name, color_index_wave_name)
+                continue
+
+            marker_number_wave_name = f"{prefix}MarkerNumber"
+            marker_size_wave_name = f"{prefix}MarkerSize"
+            self.write_runs_wave(marker_number_wave_name, [(8, rows)])
+            marker_sizes = []
+            for _, _, points in filter(lambda start: start[0] == tool, starts):
+                # The extra size 8 is for the NaN row after each path.
+                marker_sizes += [(5, 1), (8, max(points - 2, 0)), (3, 1), (8, 1)]
+            self.write_runs_wave(marker_size_wave_name, marker_sizes)
+            self.write_runs_wave(color_index_wave_name, [(tool, rows)])
+            self.append_path_to_graph(
+                tool,
+                wave_name,
+                marker_number_wave_name,
+                marker_size_wave_name,
+                color_index_wave_name,
+            )
+
+        # Where each path is in the merged waves, in place of firstWaveNumber. Each
+        # row is the tool number (which picks the wave), the first row and the number
+        # of rows.
+        self.write_matrix_wave("pathStarts", starts)
+
+    def write_marker_waves(
+        self,
+        tool: int,
+        points: int,
+        marker_number_wave_name: str,
+        marker_size_wave_name: str,
+        color_index_wave_name: str,
+    ):
+        # Write the marker numbers (not used for Gerber files, but required in the Igor procedures).
+        self.write_runs_wave(marker_number_wave_name, [(8, points)])
+
+        # Write the marker sizes. Starting point is size 5, midpoints are size 8 and
+        # the end point is size 3.
+        self.write_runs_wave(
+            marker_size_wave_name, [(5, 1), (8, max(points - 2, 0)), (3, 1)]
         )
-        self.file.write_line(
-            "X SetVariable lastEndYDisplay,pos={124.00,42.00},size={120.00,17.00}"
+
+        # Write the indexes into the color wave.
+        self.write_runs_wave(color_index_wave_name, [(tool, points)])
+
+    def plot_instance(self, tool: Tool, path: PathBuffer):
+        # Write a path as a copy of its shape, writing the shape first if no earlier
+        # path had it.
+        xs = path.xs
+        ys = path.ys
+        self.update_bounds(
+            [min(xs) / COUNTS_PER_INCH, max(xs) / COUNTS_PER_INCH],
+            [min(ys) / COUNTS_PER_INCH, max(ys) / COUNTS_PER_INCH],
         )
-        self.file.write_line("X SetVariable lastEndYDisplay,fSize=12,frame=0")
-        self.file.write_line(
-            'X SetVariable lastEndYDisplay,limits={-inf,inf,0},value=lastPathEnds[1][1],noedit= 1,title=" "'
+        key = (
+            tool.value,
+            array("q", map(sub, xs[1:], xs)).tobytes(),
+            array("q", map(sub, ys[1:], ys)).tobytes(),
         )
+        shape = self.shapes.get(key)
+        if shape is None:
+            shape = len(self.shapes) + 1
+            self.shapes[key] = shape
+            self.write_xy_wave(
+                f"shape{shape}",
+                [(x - xs[0]) / COUNTS_PER_INCH for x in xs],
+                [(y - ys[0]) / COUNTS_PER_INCH for y in ys],
+            )
+            self.write_marker_waves(
+                tool.value,
+                len(path),
+                f"shapeMarkerNumber{shape}",
+                f"shapeMarkerSize{shape}",
+                f"shapeColorIndex{shape}",
+            )
 
-        self.file.write_line(
-            'X CheckBox showEndsCheckBox,pos={5.00,63.00},size={48.00,16.00},proc=ShowEndsCheckProc,title="Show"'
+        self.wave_number += 1
+        self.place_shape(shape, self.wave_number, path.point(0))
+
+        if not self.first_wave_graphed:
+            self.first_wave_graphed = True
+            self.append_path_to_graph(
+                tool.value,
+                f"path{self.wave_number}",
+                f"markerNumber{self.wave_number}",
+                f"markerSize{self.wave_number}",
+                f"colorIndex{self.wave_number}",
+            )
+            self.write_last_ends_wave(path.point(0), path.point(-1))
+
+    def place_shape(self, shape: int, wave_number: int, location: Point):
+        # Write the command that copies a shape's waves to the waves of path
+        # wave_number and moves the copy to location.
+        wave_name = f"path{wave_number}"
+        x = self.format(location.x / COUNTS_PER_INCH)
+        y = self.format(location.y / COUNTS_PER_INCH)
+        self.write_command(
+            f"Duplicate/O shape{shape}, {wave_name}; {wave_name}[][0] += {x}"
+            f"; {wave_name}[][1] += {y}"
+            f"; Duplicate/O shapeMarkerNumber{shape}, markerNumber{wave_number}"
+            f"; Duplicate/O shapeMarkerSize{shape}, markerSize{wave_number}"
+            f"; Duplicate/O shapeColorIndex{shape}, colorIndex{wave_number}"
         )
-        self.file.write_line("X CheckBox showEndsCheckBox,fSize=12,value= 0")
 
-        self.output_file.close()
+    def plot_path(self, tool: Tool, path: PathBuffer):
+        if self.instances and len(path) >= MIN_INSTANCE_POINTS:
+            self.plot_instance(tool, path)
+            return
+
+        xs, ys = self.path_inches(path)
+        self.update_bounds(xs, ys)
+
+        if self.merge:
+            self.merge_path(tool.value, xs, ys)
+            if not self.first_wave_graphed:
+                self.first_wave_graphed = True
+                self.write_last_ends_wave(path.point(0), path.point(-1))
+            return
 
-    def write_last_ends_wave(self, start: Point, end: Point):
-        self.file.write_line("WAVES/O/N=(2, 2) lastPathEnds")
-        self.file.write_line("BEGIN")
-        self.file.write_line(f"\t{start.x}\t{start.y}")
-        self.file.write_line(f"\t{end.x}\t{end.y}")
-        self.file.write_line("END")
-
-        self.file.write_line("WAVES/O/N=(2, 3) lastPathEndColors")
-        self.file.write_line("BEGIN")
-        self.file.write_line("\t0\t35050\t0")
-        self.file.write_line("\t35050\t0\t0")
-        self.file.write_line("END")
-
-        self.file.write_line("WAVES/I/U lastPathEndMarkers")
-        self.file.write_line("BEGIN")
-        self.file.write_line("\t18")
-        self.file.write_line("\t55")
-        self.file.write_line("END")
-
-    def plot_path(self, tool: int, path: list[Point]):
         self.wave_number += 1
 
         wave_name = f"path{self.wave_number}"
         marker_number_wave_name = f"markerNumber{self.wave_number}"
         marker_size_wave_name = f"markerSize{self.wave_number}"
         color_index_wave_name = f"colorIndex{self.wave_number}"
-        marker_color = (
-            "16385,65535,36045,32768" if tool == 0 else "65535,16385,36045,32768"
-        )
+        points = len(path)
 
         # Write the path coordinates.
-        self.file.write_line(f"WAVES/O/N=({len(path)}, 2) {wave_name}")
-        self.file.write_line("BEGIN")
-        for plot_point in path:
-            self.file.write_line(f"\t{plot_point.x}\t{plot_point.y}")
-            self.min_x = min(self.min_x, plot_point.x)
-            self.max_x = max(self.max_x, plot_point.x)
-            self.min_y = min(self.min_y, plot_point.y)
-            self.max_y = max(self.max_y, plot_point.y)
-        self.file.write_line("END")
-
-        # Write the marker numbers (not used for Gerber files, but required in the Igor procedures).
-        self.file.write_line(f"WAVES/O {marker_number_wave_name}")
-        self.file.write_line("BEGIN")
-        for _ in range(len(path)):
-            self.file.write_line("\t8")
-        self.file.write_line("END")
-
-        # Write the marker sizes.
-        self.file.write_line(f"WAVES/O {marker_size_wave_name}")
-        self.file.write_line("BEGIN")
-        # Starting point is size 5.
-        self.file.write_line("\t5")
-        for _ in range(len(path) - 2):
-            # Midpoints are size 8.
-            self.file.write_line("\t8")
-        # End point is size 3.
-        self.file.write_line("\t3")
-        self.file.write_line("END")
-
-        # Write the indexes into the color wave.
-        self.file.write_line(f"WAVES/O {color_index_wave_name}")
-        self.file.write_line("BEGIN")
-        for _ in range(len(path)):
-            self.file.write_line(f"\t{tool.value}")
-        self.file.write_line("END")
+        self.write_xy_wave(wave_name, xs, ys)
+        self.write_marker_waves(
+            tool.value,
+            points,
+            marker_number_wave_name,
+            marker_size_wave_name,
+            color_index_wave_name,
+        )
 
         if not self.first_wave_graphed:
             self.first_wave_graphed = True
-            self.file.write_line(
-                f"X AppendToGraph /W={self.graph_name} {wave_name}[*][1] vs {wave_name}[*][0]"
-            )
-            # Index into tool color wave.
-            self.file.write(
-                f"X ModifyGraph zColor({wave_name})={{{color_index_wave_name},*,*,cindexRGB,0,plotColors}}"
+            self.append_path_to_graph(
+                tool.value,
+                wave_name,
+                marker_number_wave_name,
+                marker_size_wave_name,
+                color_index_wave_name,
             )
-            # Marker specifications.
-            self.file.write(
-                f", zmrkNum({wave_name})={{{marker_number_wave_name}}}, mrkThick({wave_name})=2"
-            )
-            self.file.write(
-                f", useMrkStrokeRGB({wave_name})=1, mrkStrokeRGB({wave_name})=({marker_color}), mode({wave_name})=4"
-            )
-            self.file.write_line(
-                f", zmrkSize({wave_name})={{{marker_size_wave_name},3,8,3,8}}"
-            )
-            self.write_last_ends_wave(path[0], path[-1])
+            self.write_last_ends_wave(path.point(0), path.point(-1))
 
     def plot_drill(self, location: Point):
-        self.wave_number += 1
-        wave_name = f"path{self.wave_number}"
-        color_index_wave_name = f"colorIndex{self.wave_number}"
+        if self.batch_drills and not self.merge:
+            self.pending_drills.append(location)
+            return
 
-        circle_points = 20
+        xs, ys = self.drill_glyph.at(location)
+        self.update_drill_bounds([location])
 
-        # Write a circle around a cross.
-        self.file.write_line(f"WAVES/O/N=({circle_points + 5}, 2) {wave_name}")
-        self.file.write_line("BEGIN")
+        if self.merge:
+            self.merge_path(DRILL_TOOL, xs, ys)
+            return
 
-        # Draw the horizontal leg of the cross.
-        self.file.write_line(f"\t{location.x - 0.5}\t{location.y}")
-        self.file.write_line(f"\t{location.x + 0.5}\t{location.y}")
+        self.write_drill_wave(xs, ys)
 
-        # Draw the circle.
-        for point_number in range(circle_points):
-            t = math.pi * 2 * (point_number + 1) / circle_points
-            circle_point = location + Point(math.cos(t) / 2.0, math.sin(t) / 2.0)
-            self.file.write_line(f"\t{circle_point.x}\t{circle_point.y}")
+    def update_drill_bounds(self, locations: list[Point]):
+        radius = self.drill_glyph.radius
+        xs = [location.x for location in locations]
+        ys = [location.y for location in locations]
+        min_x = (min(xs) - radius) / COUNTS_PER_INCH
+        max_x = (max(xs) + radius) / COUNTS_PER_INCH
+        min_y = (min(ys) - radius) / COUNTS_PER_INCH
+        max_y = (max(ys) + radius) / COUNTS_PER_INCH
+        self.update_bounds([min_x, max_x], [min_y, max_y])
 
-        # Insert NaN point to break the drawing between the end of the circle
-        # and the beginning of the vertical leg of the cross.
-        self.file.write_line("\tNaN\tNaN")
+    def write_drill_wave(self, xs: list[float], ys: list[float]):
+        self.wave_number += 1
+        wave_name = f"path{self.wave_number}"
+        color_index_wave_name = f"colorIndex{self.wave_number}"
 
-        # Draw the vertical leg of the cross.
-        self.file.write_line(f"\t{location.x}\t{location.y - 0.5}")
-        self.file.write_line(f"\t{location.x}\t{location.y + 0.5}")
-        self.file.write_line("END")
+        self.write_xy_wave(wave_name, xs, ys)
 
-        # Write the indexes into the color wave. Drill index is 4.
-        drill_color_index = 4
-        self.file.write_line(f"WAVES/O {color_index_wave_name}")
-        self.file.write_line("BEGIN")
-        for _ in range(circle_points + 5):
-            self.file.write_line(f"\t{drill_color_index}")
-        self.file.write_line("END")
+        # Write the indexes into the color wave.
+        self.write_runs_wave(color_index_wave_name, [(DRILL_COLOR_INDEX, len(xs))])
 
         if not self.first_wave_graphed:
             self.first_wave_graphed = True
-            self.file.write_line(
-                f"X AppendToGraph /W={self.graph_name} {wave_name}[*][1] vs {wave_name}[*][0]"
-            )
-            # Index into tool color wave
-            self.file.write_line(
-                f"ModifyGraph zColor({wave_name})={{{color_index_wave_name},*,*,cindexRGB,0,plotColors}}"
-            )
+            self.append_drill_to_graph(wave_name, color_index_wave_name)
+
+    def end_pattern(self):
+        # Write the drill hits of the pattern that just ended as one wave.
+        if self.pending_drills:
+            self.update_drill_bounds(self.pending_drills)
+            self.write_drill_wave(*self.drill_glyph.at_many(self.pending_drills))
+            self.pending_drills = []
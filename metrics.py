@@ -0,0 +1,244 @@
+import csv
+import dataclasses
+import functools
+import json
+import math
+import sys
+from dataclasses import dataclass
+from operator import sub
+from typing import IO, Iterable
+
+import batch
+from backend import Backend
+from converter import (
+    ConversionOptions,
+    create_gerber,
+    is_toolpath_file,
+    run_gerber,
+    tool_offsets,
+)
+from path_buffer import PathBuffer
+from point import COUNTS_PER_INCH, Point, Tool
+from toolpath import Toolpath
+
+# Columns of the CSV output, in order. Drill hits per pattern are separated by
+# spaces in one column.
+CSV_COLUMNS = [
+    "file",
+    "min_x",
+    "min_y",
+    "max_x",
+    "max_y",
+    "mark_length",
+    "cut_length",
+    "travel",
+    "tool_changes",
+    "paths",
+    "drills",
+    "drills_per_pattern",
+    "seconds",
+    "error",
+]
+
+
+@dataclass(frozen=True)
+class MachineSpeeds:
+    # Used to estimate how long the machine takes to run a file. Speeds are in
+    # inches per second and times in seconds. They can be set in the [speeds] table
+    # of gerber_to_igor.toml.
+    mark: float = 1.0
+    cut: float = 0.5
+    travel: float = 4.0
+    drill: float = 0.5
+    tool_change: float = 2.0
+
+
+def path_length(path: PathBuffer) -> float:
+    # Length of a path in counts, from the differences between successive vertices.
+    xs = path.xs
+    ys = path.ys
+    return sum(map(math.hypot, map(sub, xs[1:], xs), map(sub, ys[1:], ys)))
+
+
+def inches(counts: float) -> float | None:
+    return None if math.isinf(counts) else round(counts / COUNTS_PER_INCH, 4)
+
+
+class Metrics(Backend):
+    # Measures the paths and drill hits Gerber reads instead of writing them, for
+    # sizing up jobs without converting them. Lengths are in counts until reported.
+    min_x: float
+    min_y: float
+    max_x: float
+    max_y: float
+    # Length of the paths drawn by each tool, indexed by tool number.
+    lengths: list[float]
+    # Distance moved with the tool up between one path or drill hit and the next.
+    travel: float
+    tool_changes: int
+    paths: int
+    drills_per_pattern: list[int]
+    # The tool and end of the last path or drill hit.
+    last_tool: Tool
+    last_x: int | None
+    last_y: int | None
+    # Drill hits in the current pattern, and whether it has any paths or drill hits.
+    pattern_drills: int
+    pattern_used: bool
+
+    def __init__(self):
+        self.min_x = math.inf
+        self.min_y = math.inf
+        self.max_x = -math.inf
+        self.max_y = -math.inf
+        self.lengths = [0.0, 0.0]
+        self.travel = 0.0
+        self.tool_changes = 0
+        self.paths = 0
+        self.drills_per_pattern = []
+        self.last_tool = Tool.NONE
+        self.last_x = None
+        self.last_y = None
+        self.pattern_drills = 0
+        self.pattern_used = False
+
+    def start_work(self, tool: Tool, x: int, y: int) -> None:
+        # Count the move with the tool up to (x, y) and any change of tool.
+        if self.last_x is not None:
+            self.travel += math.hypot(x - self.last_x, y - self.last_y)
+        if tool != self.last_tool and self.last_tool != Tool.NONE:
+            self.tool_changes += 1
+        self.last_tool = tool
+        self.pattern_used = True
+
+    def plot_path(self, tool: Tool, path: PathBuffer) -> None:
+        xs = path.xs
+        ys = path.ys
+        self.start_work(tool, xs[0], ys[0])
+        self.min_x = min(self.min_x, min(xs))
+        self.min_y = min(self.min_y, min(ys))
+        self.max_x = max(self.max_x, max(xs))
+        self.max_y = max(self.max_y, max(ys))
+        self.lengths[tool.value] += path_length(path)
+        self.paths += 1
+        self.last_x = xs[-1]
+        self.last_y = ys[-1]
+
+    def plot_drill(self, location: Point) -> None:
+        self.start_work(Tool.DRILL, location.x, location.y)
+        self.min_x = min(self.min_x, location.x)
+        self.min_y = min(self.min_y, location.y)
+        self.max_x = max(self.max_x, location.x)
+        self.max_y = max(self.max_y, location.y)
+        self.pattern_drills += 1
+        self.last_x = location.x
+        self.last_y = location.y
+
+    def end_pattern(self) -> None:
+        # Patterns without any paths or drill hits, like the one before the first N,
+        # aren't reported.
+        if self.pattern_used:
+            self.drills_per_pattern.append(self.pattern_drills)
+        self.pattern_drills = 0
+        self.pattern_used = False
+
+    def finish(self) -> None:
+        self.end_pattern()
+
+    def estimated_seconds(self, speeds: MachineSpeeds) -> float:
+        return (
+            self.lengths[Tool.MARK.value] / COUNTS_PER_INCH / speeds.mark
+            + self.lengths[Tool.CUT.value] / COUNTS_PER_INCH / speeds.cut
+            + self.travel / COUNTS_PER_INCH / speeds.travel
+            + sum(self.drills_per_pattern) * speeds.drill
+            + self.tool_changes * speeds.tool_change
+        )
+
+    def summary(self, speeds: MachineSpeeds) -> dict:
+        # The metrics as a dict that can be written as JSON, with lengths and the
+        # bounding box in inches. The bounding box is None without any work.
+        return {
+            "min_x": inches(self.min_x),
+            "min_y": inches(self.min_y),
+            "max_x": inches(self.max_x),
+            "max_y": inches(self.max_y),
+            "mark_length": inches(self.lengths[Tool.MARK.value]),
+            "cut_length": inches(self.lengths[Tool.CUT.value]),
+            "travel": inches(self.travel),
+            "tool_changes": self.tool_changes,
+            "paths": self.paths,
+            "drills": sum(self.drills_per_pattern),
+            "drills_per_pattern": self.drills_per_pattern,
+            "seconds": round(self.estimated_seconds(speeds), 1),
+        }
+
+
+def measure_file(
+    file_name: str, options: ConversionOptions, speeds: MachineSpeeds | None = None
+) -> dict:
+    # Read a Gerber file or saved toolpath with the offsets in options and return its
+    # metrics, without writing any output. Every pattern is measured: M0 ends a
+    # pattern rather than the file.
+    if speeds is None:
+        speeds = MachineSpeeds()
+    metrics = Metrics()
+    if is_toolpath_file(file_name):
+        Toolpath.load(file_name).render(metrics, tool_offsets(options))
+    else:
+        gerber = create_gerber(options, metrics, through_stops=True)
+        run_gerber(gerber, file_name, options.jobs, options.pipeline)
+        gerber.finish()
+    return {"file": file_name, **metrics.summary(speeds)}
+
+
+def measure_one(
+    file_name: str, options: ConversionOptions, speeds: MachineSpeeds | None = None
+) -> dict:
+    # Measure a file, reporting a failure in the result. See batch.run_one.
+    result, error = batch.run_one(
+        functools.partial(measure_file, options=options, speeds=speeds), file_name
+    )
+    return result if error is None else {"file": file_name, "error": error}
+
+
+def measure_batch(
+    file_names: list[str],
+    options: ConversionOptions,
+    workers: int | None = None,
+    speeds: MachineSpeeds | None = None,
+) -> Iterable[dict]:
+    # Measure files in a pool of worker processes, yielding the metrics in the order
+    # the files were given.
+    options = dataclasses.replace(options, jobs=1)
+    measure = functools.partial(measure_one, options=options, speeds=speeds)
+    return batch.run_batch(
+        measure, file_names, batch.worker_count(workers, len(file_names))
+    )
+
+
+def write_json(results: list[dict], out: IO) -> None:
+    json.dump(results, out, indent=2)
+    out.write("\n")
+
+
+def write_csv(results: list[dict], out: IO) -> None:
+    writer = csv.DictWriter(out, CSV_COLUMNS)
+    writer.writeheader()
+    for result in results:
+        row = dict(result)
+        if "drills_per_pattern" in row:
+            row["drills_per_pattern"] = " ".join(map(str, row["drills_per_pattern"]))
+        writer.writerow(row)
+
+
+def write_results(results: list[dict], file_name: str) -> None:
+    # Write results as CSV to a .csv file, and as JSON to any other file or to the
+    # terminal with "-".
+    if file_name == "-":
+        write_json(results, sys.stdout)
+    elif file_name.lower().endswith(".csv"):
+        with open(file_name, "w", newline="") as f:
+            write_csv(results, f)
+    else:
+        with open(file_name, "w") as f:
+            write_json(results, f)
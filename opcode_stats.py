@@ -0,0 +1,39 @@
+from gerber_token import COORDINATE_CODE, NO_VALUE
+
+
+def opcode_name(code: int, value: int) -> str:
+    # The name of a command as it appears in a Gerber file, like D1 or M14.
+    if code == COORDINATE_CODE:
+        return "XY"
+    return chr(code) if value == NO_VALUE else f"{chr(code)}{value}"
+
+
+class OpcodeStats:
+    # How many times each command ran and the time spent running it, including the
+    # output it caused. Commands are keyed on (character code, value) as they are
+    # stored in a TokenBatch.
+    counts: dict[tuple[int, int], int]
+    nanoseconds: dict[tuple[int, int], int]
+
+    def __init__(self):
+        self.counts = {}
+        self.nanoseconds = {}
+
+    def add(self, code: int, value: int, nanoseconds: int) -> None:
+        key = (code, value)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.nanoseconds[key] = self.nanoseconds.get(key, 0) + nanoseconds
+
+    def report(self) -> str:
+        # A table of the commands, the most time first.
+        total = sum(self.nanoseconds.values()) or 1
+        lines = [f"{'Command':<8}{'Count':>12}{'ms':>12}{'ns each':>10}{'%':>8}"]
+        for key, nanoseconds in sorted(
+            self.nanoseconds.items(), key=lambda item: item[1], reverse=True
+        ):
+            count = self.counts[key]
+            lines.append(
+                f"{opcode_name(*key):<8}{count:>12}{nanoseconds / 1e6:>12.2f}"
+                f"{nanoseconds // count:>10}{100 * nanoseconds / total:>8.1f}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,410 @@
+import math
+import os
+from array import array
+
+from converter import (
+    ConversionOptions,
+    compile_toolpath,
+    render_toolpath,
+    tool_offsets,
+)
+from gerber_writer import write_gerber
+from metrics import Metrics, inches
+from path_buffer import PathBuffer
+from point import Tool
+from toolpath import DRILL, PATH, RETURN, Toolpath
+
+# Most 2-opt passes over each group of paths. Each pass tries every path.
+MAX_TWO_OPT_PASSES = 3
+
+# Longest run of paths a 2-opt move reverses, so one move can't take a long time.
+MAX_REVERSAL = 1000
+
+# Offsets of a grid cell and the cells around it.
+NEIGHBOURHOOD = [(dc, dr) for dc in (-1, 0, 1) for dr in (-1, 0, 1)]
+
+# Swaps 0 and 1, to turn every path in a run around at once.
+FLIP = bytes([1, 0]) + bytes(254)
+
+
+class Items:
+    # The ends of the paths and drill hits in part of a toolpath, indexed by item
+    # number. A drill hit starts and ends at the same place.
+    start_xs: array
+    start_ys: array
+    end_xs: array
+    end_ys: array
+
+    def __init__(self):
+        self.start_xs = array("q")
+        self.start_ys = array("q")
+        self.end_xs = array("q")
+        self.end_ys = array("q")
+
+    def __len__(self) -> int:
+        return len(self.start_xs)
+
+    def add(self, start_x: int, start_y: int, end_x: int, end_y: int) -> None:
+        self.start_xs.append(start_x)
+        self.start_ys.append(start_y)
+        self.end_xs.append(end_x)
+        self.end_ys.append(end_y)
+
+    def ends(self, item: int, flipped: int) -> tuple[int, int, int, int]:
+        # The start and end of an item, swapped if it is flipped.
+        if flipped:
+            return (
+                self.end_xs[item],
+                self.end_ys[item],
+                self.start_xs[item],
+                self.start_ys[item],
+            )
+        return (
+            self.start_xs[item],
+            self.start_ys[item],
+            self.end_xs[item],
+            self.end_ys[item],
+        )
+
+
+class EndGrid:
+    # Buckets the ends of some of the items into a uniform grid with about one item
+    # per cell, to find the item nearest to a location. Each entry is the item and
+    # whether starting from that end means flipping the item.
+    cell_size: int
+    cells: dict[tuple[int, int], list[tuple[int, int]]]
+    min_column: int
+    max_column: int
+    min_row: int
+    max_row: int
+
+    def __init__(self, items: Items, members: list[int], flip: bool):
+        xs = [items.start_xs[item] for item in members]
+        ys = [items.start_ys[item] for item in members]
+        if flip:
+            xs += [items.end_xs[item] for item in members]
+            ys += [items.end_ys[item] for item in members]
+        span = max(max(xs) - min(xs), max(ys) - min(ys), 1)
+        self.cell_size = max(round(span / math.sqrt(len(members))), 1)
+
+        self.cells = {}
+        entries = [(item, 0) for item in members]
+        if flip:
+            entries += [(item, 1) for item in members]
+        for x, y, entry in zip(xs, ys, entries):
+            self.cells.setdefault(self.cell(x, y), []).append(entry)
+        columns = [column for column, _ in self.cells]
+        rows = [row for _, row in self.cells]
+        self.min_column = min(columns)
+        self.max_column = max(columns)
+        self.min_row = min(rows)
+        self.max_row = max(rows)
+
+    def cell(self, x: int, y: int) -> tuple[int, int]:
+        return x // self.cell_size, y // self.cell_size
+
+    def ring(self, column: int, row: int, radius: int) -> list[tuple[int, int]]:
+        # The cells at Chebyshev distance radius from (column, row).
+        if radius == 0:
+            return [(column, row)]
+        cells = []
+        for offset in range(-radius, radius + 1):
+            cells.append((column + offset, row - radius))
+            cells.append((column + offset, row + radius))
+        for offset in range(-radius + 1, radius):
+            cells.append((column - radius, row + offset))
+            cells.append((column + radius, row + offset))
+        return cells
+
+    def nearest(
+        self, items: Items, x: int, y: int, used: bytearray
+    ) -> tuple[int, int] | None:
+        # Return the unused entry with the end nearest to (x, y), searching rings of
+        # cells outwards until no nearer one can be in the next ring. Once a ring has
+        # more cells than are in use, as it does far from the items, all the cells
+        # in use are searched instead.
+        column, row = self.cell(x, y)
+        last_radius = max(
+            abs(column - self.min_column),
+            abs(column - self.max_column),
+            abs(row - self.min_row),
+            abs(row - self.max_row),
+        )
+        best = None
+        best_distance = math.inf
+        for radius in range(last_radius + 1):
+            everywhere = 8 * radius > len(self.cells)
+            if everywhere:
+                cells = self.cells.values()
+            else:
+                cells = [
+                    self.cells.get(cell, ()) for cell in self.ring(column, row, radius)
+                ]
+            for entries in cells:
+                for item, flipped in entries:
+                    if used[item]:
+                        continue
+                    if flipped:
+                        dx = items.end_xs[item] - x
+                        dy = items.end_ys[item] - y
+                    else:
+                        dx = items.start_xs[item] - x
+                        dy = items.start_ys[item] - y
+                    distance = dx * dx + dy * dy
+                    if distance < best_distance:
+                        best = (item, flipped)
+                        best_distance = distance
+            if everywhere:
+                break
+            reach = radius * self.cell_size
+            if best is not None and best_distance <= reach * reach:
+                break
+        return best
+
+
+def nearest_neighbour(
+    items: Items,
+    members: list[int],
+    location: tuple[int, int] | None,
+    flip: bool,
+) -> tuple[list[int], bytearray]:
+    # Order members by always going to the nearest unused one next, starting from
+    # location, or from the first member without one. Return the order and whether
+    # each item in it is flipped. The grid is rebuilt with the unused items whenever
+    # a quarter of them are left, so searches don't cross many empty cells.
+    used = bytearray(len(items))
+    order = []
+    flips = bytearray()
+    if location is None:
+        first = members[0]
+        used[first] = 1
+        order.append(first)
+        flips.append(0)
+        location = (items.end_xs[first], items.end_ys[first])
+
+    remaining = [item for item in members if not used[item]]
+    while remaining:
+        grid = EndGrid(items, remaining, flip)
+        for _ in range(len(remaining) - len(remaining) // 4):
+            item, flipped = grid.nearest(items, location[0], location[1], used)
+            used[item] = 1
+            order.append(item)
+            flips.append(flipped)
+            _, _, end_x, end_y = items.ends(item, flipped)
+            location = (end_x, end_y)
+        remaining = [item for item in remaining if not used[item]]
+    return order, flips
+
+
+def two_opt(
+    items: Items,
+    order: list[int],
+    flips: bytearray,
+    location: tuple[int, int] | None,
+) -> None:
+    # Improve an order in place with 2-opt moves: reverse the run of items after a
+    # up to b, turning each one around, when joining the end of a to the end of b
+    # shortens the travel. Only moves that join ends in the same or neighbouring
+    # cells of a grid, and that are shorter than the join they replace, are tried.
+    count = len(order)
+    if count < 2:
+        return
+    grid = EndGrid(items, order, True)
+    start_xs = items.start_xs
+    start_ys = items.start_ys
+    end_xs = items.end_xs
+    end_ys = items.end_ys
+    positions = array("q", bytes(8 * len(items)))
+    for position, item in enumerate(order):
+        positions[item] = position
+
+    def ends(position: int) -> tuple[int, int, int, int]:
+        # The start and end of the item at position, or location before the first.
+        if position < 0:
+            return location + location
+        item = order[position]
+        if flips[position]:
+            return end_xs[item], end_ys[item], start_xs[item], start_ys[item]
+        return start_xs[item], start_ys[item], end_xs[item], end_ys[item]
+
+    first_position = 0 if location is None else -1
+    for _ in range(MAX_TWO_OPT_PASSES):
+        improved = False
+        for a in range(first_position, count - 1):
+            _, _, x_a, y_a = ends(a)
+            x_next, y_next, _, _ = ends(a + 1)
+            join = math.hypot(x_next - x_a, y_next - y_a)
+            column, row = grid.cell(x_a, y_a)
+            for dc, dr in NEIGHBOURHOOD:
+                for item, at_end in grid.cells.get((column + dc, row + dr), ()):
+                    b = positions[item]
+                    # The entry has to be where the item ends as it is now run.
+                    if b == a or at_end == flips[b]:
+                        continue
+                    if at_end:
+                        x_b = end_xs[item]
+                        y_b = end_ys[item]
+                    else:
+                        x_b = start_xs[item]
+                        y_b = start_ys[item]
+                    new_join = math.hypot(x_b - x_a, y_b - y_a)
+                    if new_join >= join:
+                        continue
+                    first, last = (a, b) if a < b else (b, a)
+                    if last - first > MAX_REVERSAL:
+                        continue
+                    _, _, x_first, y_first = ends(first)
+                    x_inner, y_inner, _, _ = ends(first + 1)
+                    _, _, x_last, y_last = ends(last)
+                    before = math.hypot(x_inner - x_first, y_inner - y_first)
+                    after = math.hypot(x_last - x_first, y_last - y_first)
+                    if last + 1 < count:
+                        x_after, y_after, _, _ = ends(last + 1)
+                        before += math.hypot(x_after - x_last, y_after - y_last)
+                        after += math.hypot(x_after - x_inner, y_after - y_inner)
+                    if after < before - 1e-9:
+                        run = slice(first + 1, last + 1)
+                        order[run] = order[run][::-1]
+                        flips[run] = flips[run][::-1].translate(FLIP)
+                        for moved in range(first + 1, last + 1):
+                            positions[order[moved]] = moved
+                        improved = True
+                        _, _, x_a, y_a = ends(a)
+                        x_next, y_next, _, _ = ends(a + 1)
+                        join = math.hypot(x_next - x_a, y_next - y_a)
+        if not improved:
+            break
+
+
+def sequence_travel(
+    items: Items, sequence: list[tuple[int, int]], location: tuple[int, int] | None
+) -> float:
+    # Travel between the items of a sequence of (item, flipped), starting at
+    # location, if there is one.
+    total = 0.0
+    for item, flipped in sequence:
+        start_x, start_y, end_x, end_y = items.ends(item, flipped)
+        if location is not None:
+            total += math.hypot(start_x - location[0], start_y - location[1])
+        location = (end_x, end_y)
+    return total
+
+
+def optimize_toolpath(toolpath: Toolpath, flip: bool = False) -> Toolpath:
+    # Reorder the paths and drill hits of a toolpath to shorten the travel with the
+    # tool up. Only paths and drill hits between the same pattern, file, origin,
+    # return, speed and stop records are reordered, and they are grouped by tool in
+    # the order each tool is first used there. With flip, paths can also be run
+    # backwards, and the order is improved further with 2-opt. Where this doesn't
+    # shorten the travel, the original order is kept.
+    records = list(toolpath.records())
+    optimized = Toolpath()
+    location = None
+
+    def optimize_run(run: list[int]) -> None:
+        nonlocal location
+        groups: dict[int, list[int]] = {}
+        items = Items()
+        for index in run:
+            kind, first, second, path = records[index]
+            if kind == PATH:
+                groups.setdefault(first, []).append(len(items))
+                items.add(path.xs[0], path.ys[0], path.xs[-1], path.ys[-1])
+            else:
+                groups.setdefault(Tool.DRILL.value, []).append(len(items))
+                items.add(first, second, first, second)
+
+        sequence = []
+        start = location
+        for members in groups.values():
+            order, flips = nearest_neighbour(items, members, start, flip)
+            if flip:
+                two_opt(items, order, flips, start)
+            sequence += zip(order, flips)
+            _, _, end_x, end_y = items.ends(order[-1], flips[-1])
+            start = (end_x, end_y)
+        original = [(item, 0) for item in range(len(items))]
+        if sequence_travel(items, sequence, location) >= sequence_travel(
+            items, original, location
+        ):
+            # Grouping by tool can cost more than it saves, and some files are
+            # already in a good order, like a step and repeat.
+            sequence = original
+
+        for item, flipped in sequence:
+            kind, first, second, path = records[run[item]]
+            if kind == PATH:
+                if flipped:
+                    path = PathBuffer(path.xs[::-1], path.ys[::-1])
+                optimized.add_path(Tool(first), path)
+            else:
+                optimized.add(DRILL, first, second)
+            _, _, end_x, end_y = items.ends(item, flipped)
+            location = (end_x, end_y)
+
+    run = []
+    for index, (kind, first, second, path) in enumerate(records):
+        if kind in (PATH, DRILL):
+            run.append(index)
+            continue
+        if run:
+            optimize_run(run)
+            run = []
+        if kind == RETURN:
+            # The tool starts from the origin again.
+            location = (first, second)
+        optimized.add(kind, first, second)
+    if run:
+        optimize_run(run)
+    return optimized
+
+
+def travel(toolpath: Toolpath, options: ConversionOptions) -> float:
+    # Travel with the tool up (in inches) when the toolpath is run with the offsets
+    # in options.
+    metrics = Metrics()
+    toolpath.render(metrics, tool_offsets(options))
+    return inches(metrics.travel)
+
+
+def job_summary(toolpath: Toolpath) -> tuple[list[tuple[int, int, int]], int, int]:
+    # What reordering has to keep: the pattern, file, origin, return, speed and stop
+    # records in order, and the number of drill hits and vertices.
+    records = []
+    drills = 0
+    vertices = 0
+    for kind, first, second, _ in toolpath.records():
+        if kind == PATH:
+            vertices += second
+        elif kind == DRILL:
+            drills += 1
+        else:
+            records.append((kind, first, second))
+    return records, drills, vertices
+
+
+def optimize_file(
+    file_name: str, options: ConversionOptions, flip: bool = False
+) -> tuple[list[str], float, float]:
+    # Reorder the paths of a Gerber file or saved toolpath to shorten the travel,
+    # write the new order as name_optimized.gbr along with its output, like
+    # name_optimized.itx, and return the names of the files written and the travel
+    # (in inches) before and after. Every pattern is optimized, not just the first.
+    # The Gerber file written is read back to check that it has the same patterns,
+    # drill hits and vertices as the input.
+    toolpath = compile_toolpath(file_name, options, through_stops=True)
+    optimized = optimize_toolpath(toolpath, flip)
+
+    basename = os.path.splitext(file_name)[0] + "_optimized"
+    gerber_name = basename + ".gbr"
+    with open(gerber_name, "w") as f:
+        write_gerber(optimized, f)
+    written = compile_toolpath(gerber_name, options, through_stops=True)
+    if job_summary(written) != job_summary(toolpath):
+        raise ValueError(f"{gerber_name} doesn't do the same work as {file_name}.")
+    output_names = render_toolpath(optimized, basename, options)
+    return (
+        [gerber_name] + output_names,
+        travel(toolpath, options),
+        travel(optimized, options),
+    )
@@ -0,0 +1,37 @@
+from array import array
+from typing import Iterator, Self
+
+from point import Point
+
+
+class PathBuffer:
+    # A path stored as two growable arrays of coordinates in counts rather than a list
+    # of Points, so whole paths can be offset in one pass.
+    __slots__ = ("xs", "ys")
+
+    xs: array
+    ys: array
+
+    def __init__(self, xs: array | None = None, ys: array | None = None):
+        self.xs = array("q") if xs is None else xs
+        self.ys = array("q") if ys is None else ys
+
+    def __len__(self) -> int:
+        return len(self.xs)
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return zip(self.xs, self.ys)
+
+    def append(self, x: int, y: int) -> None:
+        self.xs.append(x)
+        self.ys.append(y)
+
+    def point(self, index: int) -> Point:
+        return Point(self.xs[index], self.ys[index])
+
+    def translated(self, offset: Point) -> Self:
+        # Return a new path with every point moved by offset.
+        return PathBuffer(
+            array("q", [x + offset.x for x in self.xs]),
+            array("q", [y + offset.y for y in self.ys]),
+        )
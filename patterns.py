@@ -0,0 +1,218 @@
+import bisect
+import json
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from converter import (
+    ConversionOptions,
+    create_gerber,
+    create_output,
+    output_file_names,
+)
+from point import Point, Units
+from tokenizer import TOKEN_PATTERN, tokenize_range
+
+# Patterns end with M0, which stops the conversion of a whole file.
+STOP_PATTERN = re.compile(rb"M0+(?![0-9])")
+
+# The commands that change the state carried from one pattern to the next: G4 sets
+# the origin, G70/G71/G91 set the units and M70 goes to the origin.
+STATE_PATTERN = re.compile(rb"G0*(4|70|71|91)(?![0-9])|M0*70(?![0-9])")
+
+COORDINATE_PATTERN = re.compile(rb"X(-?\d+)Y(-?\d+)")
+FILE_NUMBER_PATTERN = re.compile(rb"H(\d+)")
+PATTERN_NUMBER_PATTERN = re.compile(rb"N(\d+)")
+ANY_TOKEN_PATTERN = re.compile(TOKEN_PATTERN.pattern.encode())
+
+UNITS_CODES = {70: Units.THOUSANDTHS, 71: Units.TENTHS, 91: Units.HUNDREDTHS}
+
+
+@dataclass(frozen=True)
+class PatternBlock:
+    # The commands of one pattern, as a byte range of the file ending just after its
+    # M0, and the state the earlier patterns leave for it.
+    number: int
+    start: int
+    end: int
+    file_number: int | None
+    pattern_number: int | None
+    units: Units
+    origin: Point
+    location: Point
+
+
+class StateScanner:
+    # Works out the units, origin and location at any point of a file from the few
+    # commands that change them, without interpreting the whole file. Locations are
+    # in counts.
+    data: mmap.mmap
+    origin: Point
+    # Positions where the units change and the units from there on.
+    units_positions: list[int]
+    units: list[Units]
+    # Position of the last M70 scanned and the origin it went to.
+    return_position: int
+    return_origin: Point
+
+    def __init__(self, data: mmap.mmap, units: Units):
+        self.data = data
+        self.origin = Point(0, 0)
+        self.units_positions = [-1]
+        self.units = [units]
+        self.return_position = -1
+        self.return_origin = Point(0, 0)
+
+    def units_at(self, position: int) -> Units:
+        return self.units[bisect.bisect_right(self.units_positions, position) - 1]
+
+    def location_at(self, position: int) -> Point:
+        # The location is set by the last coordinate or M70 before position.
+        coordinate_position = self.data.rfind(b"X", 0, position)
+        if coordinate_position > self.return_position:
+            match = COORDINATE_PATTERN.match(self.data, coordinate_position)
+            if match:
+                units = self.units_at(coordinate_position)
+                return Point.from_xy(int(match[1]), int(match[2]), units)
+        if self.return_position >= 0:
+            return self.return_origin
+        return Point(0, 0)
+
+    def scan(self, start: int, end: int) -> None:
+        # Apply the state changes between start and end. Ranges must be scanned in
+        # file order.
+        for match in STATE_PATTERN.finditer(self.data, start, end):
+            if match[1] is None:
+                self.return_position = match.start()
+                self.return_origin = self.origin
+            elif int(match[1]) == 4:
+                self.origin = self.location_at(match.start())
+            else:
+                self.units_positions.append(match.start())
+                self.units.append(UNITS_CODES[int(match[1])])
+
+
+def number_in(pattern: re.Pattern, data: mmap.mmap, start: int, end: int) -> int | None:
+    match = pattern.search(data, start, end)
+    return int(match[1]) if match else None
+
+
+def split_patterns(file_name: str, options: ConversionOptions) -> list[PatternBlock]:
+    # Split a file into its patterns. Everything after the last M0 is a pattern too
+    # if there are any commands in it. A pattern without an H command has the file
+    # number of the pattern before it.
+    blocks = []
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return blocks
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            scanner = StateScanner(data, Units.from_option(options.units))
+            ends = [match.end() for match in STOP_PATTERN.finditer(data)]
+            if ANY_TOKEN_PATTERN.search(data, ends[-1] if ends else 0):
+                ends.append(len(data))
+
+            start = 0
+            file_number = None
+            for end in ends:
+                block_file_number = number_in(FILE_NUMBER_PATTERN, data, start, end)
+                if block_file_number is not None:
+                    file_number = block_file_number
+                blocks.append(
+                    PatternBlock(
+                        len(blocks) + 1,
+                        start,
+                        end,
+                        file_number,
+                        number_in(PATTERN_NUMBER_PATTERN, data, start, end),
+                        scanner.units_at(start),
+                        scanner.origin,
+                        scanner.location_at(start),
+                    )
+                )
+                scanner.scan(start, end)
+                start = end
+    return blocks
+
+
+def pattern_basename(file_name: str, block: PatternBlock) -> str:
+    basename, _ = os.path.splitext(file_name)
+    return f"{basename}_pattern{block.number}"
+
+
+def index_file_name(file_name: str) -> str:
+    basename, _ = os.path.splitext(file_name)
+    return basename + "_patterns.json"
+
+
+def convert_pattern(
+    file_name: str, block: PatternBlock, options: ConversionOptions
+) -> list[str]:
+    # Convert one pattern to name_patternN and return the names of the output files.
+    # Runs in a worker process, which reads only the pattern's part of the file.
+    basename = pattern_basename(file_name, block)
+    gerber = create_gerber(options, create_output(basename, options))
+    gerber.restore_state(block.units, block.origin, block.location)
+    try:
+        gerber.command_batch(tokenize_range(file_name, block.start, block.end))
+    except BaseException:
+        gerber.abort()
+        raise
+    gerber.finish()
+    return output_file_names(basename, options)
+
+
+def convert_blocks(
+    file_name: str,
+    blocks: list[PatternBlock],
+    options: ConversionOptions,
+    workers: int | None = None,
+    executor: ProcessPoolExecutor | None = None,
+) -> list[list[str]]:
+    # Convert the given patterns of a file in a pool of worker processes and return
+    # the output file names of each. A pool that is kept running can be given as
+    # executor. A single pattern is converted in this process.
+    workers = min(workers or os.cpu_count() or 1, max(len(blocks), 1))
+    if workers == 1:
+        return [convert_pattern(file_name, block, options) for block in blocks]
+
+    count = len(blocks)
+    arguments = [file_name] * count, blocks, [options] * count
+    if executor is not None:
+        return list(executor.map(convert_pattern, *arguments))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(convert_pattern, *arguments))
+
+
+def write_index(
+    file_name: str, blocks: list[PatternBlock], output_names: list[list[str]]
+) -> str:
+    # Write the index of the pattern outputs of a file and return its name.
+    index = {
+        "file": os.path.basename(file_name),
+        "patterns": [
+            {
+                "block": block.number,
+                "file_number": block.file_number,
+                "pattern_number": block.pattern_number,
+                "outputs": [os.path.basename(name) for name in pattern_names],
+            }
+            for block, pattern_names in zip(blocks, output_names)
+        ],
+    }
+    index_name = index_file_name(file_name)
+    with open(index_name, "w") as f:
+        json.dump(index, f, indent=2)
+    return index_name
+
+
+def convert_patterns(
+    file_name: str, options: ConversionOptions, workers: int | None = None
+) -> str:
+    # Convert each pattern of a file to its own output in a pool of worker processes
+    # and write an index of the outputs. Return the name of the index.
+    blocks = split_patterns(file_name, options)
+    return write_index(
+        file_name, blocks, convert_blocks(file_name, blocks, options, workers)
+    )
@@ -2,33 +2,70 @@ from dataclasses import dataclass
 from enum import Enum
 from typing import Self
 
+# Coordinates are kept as integer counts of this many per inch. Every unit a Gerber
+# file can use is a whole number of counts, so converting to counts is exact and
+# the only rounding happens when the output is formatted.
+COUNTS_PER_INCH = 10000
+
+# Number of decimal places written for coordinates in inches. At 4 places the output
+# is exact.
+DEFAULT_PRECISION = 4
+
 
 class Units(Enum):
     TENTHS = 1
     HUNDREDTHS = 2
     THOUSANDTHS = 3
 
+    @staticmethod
+    def from_option(number: int) -> Self:
+        # The units for the --units option, defaulting to hundredths.
+        match number:
+            case 1:
+                return Units.TENTHS
+            case 3:
+                return Units.THOUSANDTHS
+            case _:
+                return Units.HUNDREDTHS
+
+    @property
+    def counts(self) -> int:
+        # Size of one unit in counts.
+        match self:
+            case Units.TENTHS:
+                return 39
+            case Units.HUNDREDTHS:
+                return 100
+            case Units.THOUSANDTHS:
+                return 10
+
+
+class Tool(Enum):
+    NONE = -1
+    MARK = 0
+    CUT = 1
+    DRILL = 2
+
 
 @dataclass(frozen=True)
 class Point:
-    x: float
-    y: float
+    # A location in counts (see COUNTS_PER_INCH).
+    x: int
+    y: int
 
     @staticmethod
     def from_xy(x: int, y: int, units: Units) -> Self:
-        match units:
-            case Units.TENTHS:
-                return Point(0.0039 * x, 0.0039 * y)
-            case Units.HUNDREDTHS:
-                return Point(0.01 * x, 0.01 * y)
-            case Units.THOUSANDTHS:
-                return Point(0.001 * x, 0.001 * y)
+        return Point(units.counts * x, units.counts * y)
 
     def from_text(text: str) -> Self:
+        # Read an "x,y" location given in inches.
         x_text, y_text = text.split(",")
-        x = float(x_text)
-        y = float(y_text)
+        x = round(float(x_text) * COUNTS_PER_INCH)
+        y = round(float(y_text) * COUNTS_PER_INCH)
         return Point(x, y)
 
     def __add__(self, other: Self) -> Self:
         return Point(self.x + other.x, self.y + other.y)
+
+    def __str__(self) -> str:
+        return f"({self.x / COUNTS_PER_INCH}, {self.y / COUNTS_PER_INCH})"
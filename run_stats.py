@@ -0,0 +1,160 @@
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+from backend import Backend
+from path_buffer import PathBuffer
+from point import Point, Tool
+
+# Stages of a conversion, in the order they happen.
+STAGES = ["read", "tokenize", "interpret", "write"]
+
+
+class RunStats:
+    # Counts and times the work of one or more conversions. Stage times are
+    # exclusive: time spent in a stage entered from inside another stage, like
+    # writing while interpreting, counts only toward the inner stage. With
+    # trace_memory, the peak memory allocated in each stage is recorded with
+    # tracemalloc, which makes everything slower. Stages can be timed from several
+    # threads, like reads in the --pipeline prefetch thread; each thread nests its
+    # own stages, so time in different threads can overlap.
+    counters: dict[str, int]
+    seconds: dict[str, float]
+    peak_bytes: dict[str, int]
+    trace_memory: bool
+    # Per thread, the stages entered and not yet left, innermost last, with the
+    # time each was last started or resumed. See stack.
+    local: threading.local
+    # Guards counters, seconds and peak_bytes, which all threads add to.
+    lock: threading.Lock
+    start: float
+
+    def __init__(self, trace_memory: bool = False):
+        self.counters = {}
+        self.seconds = {stage: 0.0 for stage in STAGES}
+        self.peak_bytes = {}
+        self.trace_memory = trace_memory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
+
+    @property
+    def stack(self) -> list[tuple[str, float]]:
+        # The stages of the calling thread.
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_seconds(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def record_peak(self, stage: str) -> None:
+        # Add the peak since the last reset to stage and start a new peak. The peak
+        # is for the whole process, so with several threads it includes their
+        # allocations too.
+        _, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            self.peak_bytes[stage] = max(self.peak_bytes.get(stage, 0), peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        stack = self.stack
+        now = time.perf_counter()
+        if stack:
+            # Pause the enclosing stage.
+            outer, started = stack[-1]
+            self.add_seconds(outer, now - started)
+            if self.trace_memory:
+                self.record_peak(outer)
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        stack.append((name, now))
+        try:
+            yield
+        finally:
+            _, started = stack.pop()
+            now = time.perf_counter()
+            self.add_seconds(name, now - started)
+            if self.trace_memory:
+                self.record_peak(name)
+            if stack:
+                # Resume the enclosing stage.
+                stack[-1] = (stack[-1][0], now)
+
+    def summary(self) -> dict:
+        # The counters and stage times as a dict that can be written as JSON.
+        summary = {
+            "seconds": time.perf_counter() - self.start,
+            "counters": dict(sorted(self.counters.items())),
+            "stages": {
+                stage: {"seconds": round(seconds, 6)}
+                for stage, seconds in self.seconds.items()
+            },
+        }
+        for stage, peak in self.peak_bytes.items():
+            summary["stages"][stage]["peak_megabytes"] = round(peak / 1e6, 3)
+        return summary
+
+    def close(self) -> None:
+        if self.trace_memory:
+            tracemalloc.stop()
+
+
+class TimedReader:
+    # A file whose reads count toward the read stage.
+    file: IO
+    stats: RunStats
+
+    def __init__(self, file: IO, stats: RunStats):
+        self.file = file
+        self.stats = stats
+
+    def read(self, size: int = -1):
+        with self.stats.stage("read"):
+            data = self.file.read(size)
+        self.stats.count("bytes_read", len(data))
+        return data
+
+
+class InstrumentedBackend(Backend):
+    # Passes every call on to backend, counting paths, vertices and drill hits and
+    # timing the calls as the write stage.
+    backend: Backend
+    stats: RunStats
+
+    def __init__(self, backend: Backend, stats: RunStats):
+        self.backend = backend
+        self.stats = stats
+
+    def plot_path(self, tool: Tool, path: PathBuffer) -> None:
+        self.stats.count("paths")
+        self.stats.count("vertices", len(path))
+        with self.stats.stage("write"):
+            self.backend.plot_path(tool, path)
+
+    def plot_drill(self, location: Point) -> None:
+        self.stats.count("drills")
+        with self.stats.stage("write"):
+            self.backend.plot_drill(location)
+
+    def end_pattern(self) -> None:
+        self.stats.count("patterns")
+        with self.stats.stage("write"):
+            self.backend.end_pattern()
+
+    def finish(self) -> None:
+        with self.stats.stage("write"):
+            self.backend.finish()
+
+    def abort(self) -> None:
+        self.backend.abort()
@@ -0,0 +1,192 @@
+import argparse
+import base64
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from converter import (
+    OUTPUT_FORMATS,
+    UNITS_OPTIONS,
+    ConversionOptions,
+    convert_file,
+    convert_text,
+    load_config,
+    options_from_dict,
+    output_formats,
+)
+from gerber import GerberDataError
+
+DEFAULT_PORT = 8765
+
+
+class RequestError(Exception):
+    pass
+
+
+def check_options(options: ConversionOptions) -> None:
+    # Reject option values the converter would otherwise misread, such as an unknown
+    # format, whether they come from the request or the config file.
+    if not isinstance(options.format, str) or not all(
+        output_format in OUTPUT_FORMATS for output_format in output_formats(options)
+    ):
+        raise RequestError(
+            f"Invalid format: {options.format!r}"
+            f" (choose from {', '.join(OUTPUT_FORMATS)})."
+        )
+    if options.units not in UNITS_OPTIONS:
+        raise RequestError(
+            f"Invalid units: {options.units!r}"
+            f" (choose from {', '.join(map(str, UNITS_OPTIONS))})."
+        )
+
+
+def run_request(request: dict, defaults: dict) -> dict:
+    # Run a conversion request in a worker process. A request has either the "path"
+    # of a Gerber file, whose outputs are written next to it, or the "gerber" text
+    # itself, whose outputs are returned. "options" overrides the server's settings.
+    options = request.get("options", {})
+    names = {field.name for field in dataclasses.fields(ConversionOptions)}
+    unknown = set(options) - names
+    if unknown:
+        raise RequestError(f"Unknown options: {', '.join(sorted(unknown))}.")
+    options = options_from_dict({**defaults, **options})
+    check_options(options)
+
+    if "path" in request:
+        return {"outputs": convert_file(request["path"], options)}
+    if "gerber" not in request:
+        raise RequestError('A request needs a "path" or "gerber".')
+    if not isinstance(request["gerber"], str):
+        raise RequestError('"gerber" should be the text of a Gerber file.')
+
+    outputs = []
+    results = convert_text(request["gerber"], options, request.get("name", "gerber"))
+    for name, data in results.items():
+        if isinstance(data, bytes):
+            data = base64.b64encode(data).decode("ascii")
+            outputs.append({"name": name, "encoding": "base64", "data": data})
+        else:
+            outputs.append({"name": name, "encoding": "utf-8", "data": data})
+    return {"outputs": outputs}
+
+
+class ConversionServer(ThreadingHTTPServer):
+    # Converts files sent as JSON to POST /convert. Each request is handled in its
+    # own thread and converted in a pool of worker processes that stay warm between
+    # requests, so a conversion doesn't pay for starting Python. The workers are
+    # started from a fork server that never has the listening socket, so workers
+    # left behind by a killed server don't keep the port in use.
+    executor: ProcessPoolExecutor
+    # Settings from the config file, read once at startup.
+    defaults: dict
+
+    def __init__(self, address: tuple[str, int], workers: int, defaults: dict):
+        # The executor has to exist before binding, which closes the server if it
+        # fails. Without a fork server (on Windows), workers are spawned, which
+        # doesn't pass on the socket either.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        else:
+            context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self.defaults = defaults
+        super().__init__(address, ConversionHandler)
+
+    def server_close(self):
+        try:
+            super().server_close()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    server: ConversionServer
+
+    def send_json(self, status: HTTPStatus, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(HTTPStatus.OK, {"status": "ok"})
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not found."})
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not found."})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise RequestError("A request should be a JSON object.")
+            result = self.server.executor.submit(
+                run_request, request, self.server.defaults
+            ).result()
+        except (
+            RequestError,
+            GerberDataError,
+            NotImplementedError,
+            EOFError,
+            ValueError,
+        ) as e:
+            # The request or the Gerber text in it can't be converted.
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except (OSError, BrokenExecutor) as e:
+            self.send_json(
+                HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+            )
+        else:
+            self.send_json(HTTPStatus.OK, result)
+
+    def log_message(self, format: str, *args):
+        logging.getLogger(__name__).info(format, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert Gerber files sent over HTTP by a long-running server."
+    )
+    parser.add_argument(
+        "--host", help="Address to listen on. (Default 127.0.0.1)", default="127.0.0.1"
+    )
+    parser.add_argument(
+        "--port",
+        help=f"Port to listen on. (Default {DEFAULT_PORT})",
+        type=int,
+        default=DEFAULT_PORT,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of worker processes. (Default: number of CPUs)",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "-v", "--verbose", help="Log each request.", action="store_true"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(message)s", level=logging.INFO if args.verbose else logging.WARNING
+    )
+    server = ConversionServer((args.host, args.port), args.workers, load_config())
+    print(f"Serving on http://{args.host}:{server.server_port}/convert")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
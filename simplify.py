@@ -0,0 +1,113 @@
+import logging
+from array import array
+from itertools import compress
+
+from backend import Backend
+from path_buffer import PathBuffer
+from point import Point, Tool
+
+
+def segment_distance_squared(
+    x: int, y: int, x0: int, y0: int, dx: int, dy: int, length_squared: int
+) -> float:
+    # Squared distance from (x, y) to the segment from (x0, y0) to (x0 + dx, y0 + dy).
+    px = x - x0
+    py = y - y0
+    if length_squared == 0:
+        return px * px + py * py
+    along = px * dx + py * dy
+    if along <= 0:
+        return px * px + py * py
+    if along >= length_squared:
+        ex = px - dx
+        ey = py - dy
+        return ex * ex + ey * ey
+    cross = px * dy - py * dx
+    return cross * cross / length_squared
+
+
+def simplify_path(path: PathBuffer, tolerance: int) -> PathBuffer:
+    # Remove the vertices of a path that aren't needed to stay within tolerance
+    # counts of it (Douglas-Peucker). The first and last vertices are always kept,
+    # and every vertex removed is within tolerance of the segment that replaces it.
+    count = len(path)
+    if count < 3 or tolerance <= 0:
+        return path
+
+    xs = path.xs
+    ys = path.ys
+    limit = tolerance * tolerance
+    keep = bytearray(count)
+    keep[0] = 1
+    keep[-1] = 1
+    spans = [(0, count - 1)]
+    while spans:
+        first, last = spans.pop()
+        x0 = xs[first]
+        y0 = ys[first]
+        dx = xs[last] - x0
+        dy = ys[last] - y0
+        length_squared = dx * dx + dy * dy
+        farthest = -1
+        farthest_distance = limit
+        for i in range(first + 1, last):
+            distance = segment_distance_squared(
+                xs[i], ys[i], x0, y0, dx, dy, length_squared
+            )
+            if distance > farthest_distance:
+                farthest = i
+                farthest_distance = distance
+        if farthest >= 0:
+            keep[farthest] = 1
+            spans.append((first, farthest))
+            spans.append((farthest, last))
+
+    if all(keep):
+        return path
+    return PathBuffer(array("q", compress(xs, keep)), array("q", compress(ys, keep)))
+
+
+class Simplifier(Backend):
+    # Simplifies each path to within tolerance counts before passing it on to
+    # backend, and logs how many vertices were removed when it finishes. Drill hits
+    # are passed on unchanged.
+    backend: Backend
+    tolerance: int
+    name: str
+    vertices_in: int
+    vertices_out: int
+    logger: logging.Logger
+
+    def __init__(self, backend: Backend, tolerance: int, name: str = ""):
+        self.backend = backend
+        self.tolerance = tolerance
+        self.name = name
+        self.vertices_in = 0
+        self.vertices_out = 0
+        self.logger = logging.getLogger(__name__)
+
+    def plot_path(self, tool: Tool, path: PathBuffer) -> None:
+        simplified = simplify_path(path, self.tolerance)
+        self.vertices_in += len(path)
+        self.vertices_out += len(simplified)
+        self.backend.plot_path(tool, simplified)
+
+    def plot_drill(self, location: Point) -> None:
+        self.backend.plot_drill(location)
+
+    def end_pattern(self) -> None:
+        self.backend.end_pattern()
+
+    def finish(self) -> None:
+        self.backend.finish()
+        if self.vertices_in:
+            self.logger.info(
+                "%s: simplified %d vertices to %d (%.1f%% fewer)",
+                self.name,
+                self.vertices_in,
+                self.vertices_out,
+                100 * (self.vertices_in - self.vertices_out) / self.vertices_in,
+            )
+
+    def abort(self) -> None:
+        self.backend.abort()
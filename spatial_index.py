@@ -0,0 +1,303 @@
+from array import array
+from dataclasses import dataclass
+from typing import Iterator, Self
+
+from backend import Backend
+from path_buffer import PathBuffer
+from point import COUNTS_PER_INCH, Point, Tool
+
+# Paths are indexed in chunks of this many segments, so a query only has to look at
+# the parts of a long path near the region.
+CHUNK_SEGMENTS = 32
+
+# Items covering more cells than this are kept in one list that every query checks,
+# so a few very large items don't fill thousands of cells.
+MAX_ITEM_CELLS = 64
+
+# Smallest cell size of a grid built from its items, in counts. Drill hits have no
+# size, so they don't count toward the typical item size.
+MIN_CELL_SIZE = COUNTS_PER_INCH // 100
+
+
+@dataclass(frozen=True)
+class Window:
+    # A rectangular region in counts.
+    min_x: int
+    min_y: int
+    max_x: int
+    max_y: int
+
+    @staticmethod
+    def from_text(text: str) -> Self:
+        # Read an "x0,y0,x1,y1" region given in inches. The corners can be any two
+        # opposite corners.
+        values = text.split(",")
+        if len(values) != 4:
+            raise ValueError(f"Window {text} should be given as x0,y0,x1,y1.")
+        x0, y0, x1, y1 = (round(float(value) * COUNTS_PER_INCH) for value in values)
+        return Window(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.min_x <= x <= self.max_x and self.min_y <= y <= self.max_y
+
+
+class GridIndex:
+    # Finds the items whose bounding boxes intersect a region by bucketing the boxes
+    # into a uniform grid, so a query only looks at the items in the cells the
+    # region covers. The grid is built at the first query after items are added,
+    # with cells the size of a typical item unless a cell size is given.
+    cell_size: int | None
+    # The cells, keyed on column and row, and the size they were built with. cells is
+    # None until the grid is built.
+    cells: dict[tuple[int, int], list[int]] | None
+    built_cell_size: int
+    large_items: list[int]
+    # Bounding box of each item, indexed by item number.
+    min_xs: array
+    min_ys: array
+    max_xs: array
+    max_ys: array
+
+    def __init__(self, cell_size: int | None = None):
+        self.cell_size = cell_size
+        self.cells = None
+        self.built_cell_size = 0
+        self.large_items = []
+        self.min_xs = array("q")
+        self.min_ys = array("q")
+        self.max_xs = array("q")
+        self.max_ys = array("q")
+
+    def __len__(self) -> int:
+        return len(self.min_xs)
+
+    def insert(self, box: Window) -> int:
+        # Add an item with the given bounding box and return its number.
+        self.min_xs.append(box.min_x)
+        self.min_ys.append(box.min_y)
+        self.max_xs.append(box.max_x)
+        self.max_ys.append(box.max_y)
+        self.cells = None
+        return len(self.min_xs) - 1
+
+    def cell_range(self, size: int, window: Window) -> tuple[range, range]:
+        return (
+            range(window.min_x // size, window.max_x // size + 1),
+            range(window.min_y // size, window.max_y // size + 1),
+        )
+
+    def build(self) -> None:
+        size = self.cell_size
+        if size is None:
+            sides = sorted(
+                side
+                for min_x, min_y, max_x, max_y in zip(
+                    self.min_xs, self.min_ys, self.max_xs, self.max_ys
+                )
+                if (side := max(max_x - min_x, max_y - min_y)) > 0
+            )
+            size = max(sides[len(sides) // 2] if sides else 0, MIN_CELL_SIZE)
+        self.cells = {}
+        self.large_items = []
+        for item in range(len(self.min_xs)):
+            columns, rows = self.cell_range(
+                size,
+                Window(
+                    self.min_xs[item],
+                    self.min_ys[item],
+                    self.max_xs[item],
+                    self.max_ys[item],
+                ),
+            )
+            if len(columns) * len(rows) > MAX_ITEM_CELLS:
+                self.large_items.append(item)
+                continue
+            for column in columns:
+                for row in rows:
+                    self.cells.setdefault((column, row), []).append(item)
+        self.built_cell_size = size
+
+    def query(self, window: Window) -> list[int]:
+        # Return the items whose bounding boxes intersect window, in the order they
+        # were inserted.
+        if self.cells is None:
+            self.build()
+        columns, rows = self.cell_range(self.built_cell_size, window)
+        candidates = set(self.large_items)
+        if len(columns) * len(rows) > len(self.cells):
+            # The window covers more cells than are in use.
+            for (column, row), items in self.cells.items():
+                if column in columns and row in rows:
+                    candidates.update(items)
+        else:
+            for column in columns:
+                for row in rows:
+                    candidates.update(self.cells.get((column, row), ()))
+        return sorted(
+            item
+            for item in candidates
+            if self.min_xs[item] <= window.max_x
+            and self.max_xs[item] >= window.min_x
+            and self.min_ys[item] <= window.max_y
+            and self.max_ys[item] >= window.min_y
+        )
+
+    def inside(self, item: int, window: Window) -> bool:
+        # Whether the bounding box of item is entirely inside window.
+        return (
+            self.min_xs[item] >= window.min_x
+            and self.max_xs[item] <= window.max_x
+            and self.min_ys[item] >= window.min_y
+            and self.max_ys[item] <= window.max_y
+        )
+
+
+def clip_segment(
+    x0: int, y0: int, x1: int, y1: int, window: Window
+) -> tuple[float, float] | None:
+    # Return the part of the segment from (x0, y0) to (x1, y1) inside window as the
+    # fractions of the way along it where it starts and ends, or None if it's all
+    # outside (Liang-Barsky).
+    dx = x1 - x0
+    dy = y1 - y0
+    start = 0.0
+    end = 1.0
+    for p, q in (
+        (-dx, x0 - window.min_x),
+        (dx, window.max_x - x0),
+        (-dy, y0 - window.min_y),
+        (dy, window.max_y - y0),
+    ):
+        if p == 0:
+            if q < 0:
+                return None
+        elif p < 0:
+            start = max(start, q / p)
+        else:
+            end = min(end, q / p)
+        if start > end:
+            return None
+    return start, end
+
+
+def clip_path(path: PathBuffer, window: Window) -> list[PathBuffer]:
+    # Cut a path at the edges of window and return the pieces inside it. Points where
+    # the path crosses an edge are rounded to the nearest count.
+    xs = path.xs
+    ys = path.ys
+    if len(path) == 1:
+        return [path] if window.contains(xs[0], ys[0]) else []
+
+    pieces = []
+    piece = None
+    for i in range(len(path) - 1):
+        x0, y0, x1, y1 = xs[i], ys[i], xs[i + 1], ys[i + 1]
+        fractions = clip_segment(x0, y0, x1, y1, window)
+        if fractions is None:
+            piece = None
+            continue
+        start, end = fractions
+        if piece is None or start > 0:
+            piece = PathBuffer()
+            piece.append(round(x0 + start * (x1 - x0)), round(y0 + start * (y1 - y0)))
+            pieces.append(piece)
+        piece.append(round(x0 + end * (x1 - x0)), round(y0 + end * (y1 - y0)))
+        if end < 1:
+            piece = None
+    return pieces
+
+
+class SpatialIndex(Backend):
+    # Keeps the paths and drill hits Gerber reads with their bounding boxes in a
+    # grid, so the ones in a region can be exported without going through the rest.
+    # Paths are indexed in chunks of CHUNK_SEGMENTS segments, and a drill hit is a
+    # chunk of its own.
+    grid: GridIndex
+    # Each item is (tool, path) for a path or (Tool.DRILL, location) for a drill
+    # hit. patterns holds the number of the pattern each item is in.
+    items: list[tuple[Tool, PathBuffer | Point]]
+    patterns: array
+    pattern: int
+    # The item and the first and last vertex of each chunk, indexed by grid item.
+    chunk_items: array
+    chunk_starts: array
+    chunk_ends: array
+
+    def __init__(self, cell_size: int | None = None):
+        self.grid = GridIndex(cell_size)
+        self.items = []
+        self.patterns = array("q")
+        self.pattern = 0
+        self.chunk_items = array("q")
+        self.chunk_starts = array("q")
+        self.chunk_ends = array("q")
+
+    def add_chunk(self, box: Window, start: int, end: int) -> None:
+        self.grid.insert(box)
+        self.chunk_items.append(len(self.items))
+        self.chunk_starts.append(start)
+        self.chunk_ends.append(end)
+
+    def plot_path(self, tool: Tool, path: PathBuffer) -> None:
+        xs = path.xs
+        ys = path.ys
+        last = len(path) - 1
+        for start in range(0, max(last, 1), CHUNK_SEGMENTS):
+            end = min(start + CHUNK_SEGMENTS, last)
+            chunk_xs = xs[start : end + 1]
+            chunk_ys = ys[start : end + 1]
+            self.add_chunk(
+                Window(min(chunk_xs), min(chunk_ys), max(chunk_xs), max(chunk_ys)),
+                start,
+                end,
+            )
+        self.items.append((tool, path))
+        self.patterns.append(self.pattern)
+
+    def plot_drill(self, location: Point) -> None:
+        self.add_chunk(Window(location.x, location.y, location.x, location.y), 0, 0)
+        self.items.append((Tool.DRILL, location))
+        self.patterns.append(self.pattern)
+
+    def end_pattern(self) -> None:
+        self.pattern += 1
+
+    def runs(self, window: Window) -> Iterator[tuple[int, int, int, bool]]:
+        # Yield (item, first vertex, last vertex, inside) for each run of adjacent
+        # chunks that intersect window, in the order they were plotted. inside is
+        # whether the whole run is inside window.
+        run = None
+        for chunk in self.grid.query(window):
+            item = self.chunk_items[chunk]
+            start = self.chunk_starts[chunk]
+            inside = self.grid.inside(chunk, window)
+            if run is not None and run[0] == item and run[2] == start:
+                run = (item, run[1], self.chunk_ends[chunk], run[3] and inside)
+                continue
+            if run is not None:
+                yield run
+            run = (item, start, self.chunk_ends[chunk], inside)
+        if run is not None:
+            yield run
+
+    def export(self, window: Window, backend: Backend) -> None:
+        # Plot the paths and drill hits in window on backend, with the paths cut at
+        # the edges of window, and finish it.
+        pattern = None
+        for item, start, end, inside in self.runs(window):
+            if pattern is not None and self.patterns[item] != pattern:
+                backend.end_pattern()
+            pattern = self.patterns[item]
+
+            tool, shape = self.items[item]
+            if tool == Tool.DRILL:
+                backend.plot_drill(shape)
+                continue
+            if start > 0 or end < len(shape) - 1:
+                shape = PathBuffer(shape.xs[start : end + 1], shape.ys[start : end + 1])
+            if inside:
+                backend.plot_path(tool, shape)
+            else:
+                for piece in clip_path(shape, window):
+                    backend.plot_path(tool, piece)
+        backend.finish()
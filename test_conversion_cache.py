@@ -0,0 +1,39 @@
+import os
+
+from conversion_cache import ConversionCache
+from converter import ConversionOptions, convert_file
+
+# A mark with points in the middle of a straight line, which only the second level
+# of detail simplifies away.
+GERBER_TEXT = "H1*N1*X0Y0*D1*X100Y0*X200Y0*X300Y0*X300Y300*D2*M0*"
+
+
+def read_outputs(output_names: list[str]) -> dict[str, bytes]:
+    outputs = {}
+    for output_name in output_names:
+        with open(output_name, "rb") as f:
+            outputs[output_name] = f.read()
+    return outputs
+
+
+def test_levels_of_detail_are_cached_separately(tmp_path):
+    file_name = str(tmp_path / "line.gbr")
+    with open(file_name, "w") as f:
+        f.write(GERBER_TEXT)
+    options = ConversionOptions(lodlevels=2)
+    cache = ConversionCache(str(tmp_path / "cache"))
+
+    output_names = convert_file(file_name, options, cache)
+    assert [os.path.basename(name) for name in output_names] == [
+        "line.itx",
+        "line_lod2.itx",
+    ]
+    converted = read_outputs(output_names)
+    for output_name in output_names:
+        os.remove(output_name)
+
+    assert convert_file(file_name, options, cache) == output_names
+    assert cache.hits == 1
+    fetched = read_outputs(output_names)
+    assert fetched == converted
+    assert fetched[output_names[0]] != fetched[output_names[1]]
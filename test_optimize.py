@@ -0,0 +1,46 @@
+from converter import ConversionOptions, compile_toolpath
+from optimize import job_summary, optimize_file
+from toolpath import DRILL, PATH, RETURN, SPEED, Toolpath
+
+# Two patterns of drill hits and marks, each run from the origin and returning to it
+# at the end, with an M70 in the middle of the second one.
+GERBER_TEXT = (
+    "H1*M70*N1*M26*"
+    "X900Y900*M43*X100Y100*M43*X500Y500*M43*"
+    "X800Y0*D1*X800Y300*D2*X0Y0*D1*X0Y300*D2*"
+    "M15*M70*M0*"
+    "N2*M26*X700Y700*M43*X200Y200*M43*M70*X600Y600*M43*X300Y300*M43*"
+    "M15*M70*M0*"
+)
+
+
+def drill_groups(toolpath: Toolpath) -> list[set[tuple[int, int]]]:
+    # The drill hits between each pair of records that aren't paths or drill hits.
+    groups = [set()]
+    for kind, first, second, _ in toolpath.records():
+        if kind == DRILL:
+            groups[-1].add((first, second))
+        elif kind != PATH:
+            groups.append(set())
+    return groups
+
+
+def test_returns_to_origin_are_kept(tmp_path):
+    file_name = str(tmp_path / "job.gbr")
+    with open(file_name, "w") as f:
+        f.write(GERBER_TEXT)
+    options = ConversionOptions(format="none")
+
+    _, before, after = optimize_file(file_name, options)
+    assert after < before
+
+    original = compile_toolpath(file_name, options, through_stops=True)
+    optimized = compile_toolpath(
+        str(tmp_path / "job_optimized.gbr"), options, through_stops=True
+    )
+    records, _, _ = job_summary(original)
+    assert [kind for kind, _, _ in records].count(RETURN) == 4
+    assert [kind for kind, _, _ in records].count(SPEED) == 2
+    assert job_summary(optimized) == job_summary(original)
+    assert drill_groups(optimized) == drill_groups(original)
+    assert list(optimized.first) != list(original.first)
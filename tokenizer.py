@@ -0,0 +1,165 @@
+import mmap
+import os
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Generator, Iterator, TextIO
+
+from gerber_token import Token, TokenBatch
+
+# Commands are a letter optionally followed by a number. Coordinates are X..Y..
+# Neither form can contain '*', so the input can be split at any '*' without
+# cutting a token in half.
+TOKEN_PATTERN = re.compile(r"([A-W,Z/])(\d*)|X(-?\d+)Y(-?\d+)")
+
+BLOCK_DELIMITER = "*"
+
+# Number of characters read from the input at a time by stream_batches.
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Number of ranges each worker gets on average. More ranges than workers keeps all of
+# the workers busy when some ranges are slower to tokenize than others.
+RANGES_PER_WORKER = 8
+
+# Size of the smallest range handed to a worker. Smaller ranges cost more in
+# inter-process overhead than they save.
+MIN_RANGE_SIZE = 1 << 16
+
+# Number of batches prefetch_batches reads ahead of the consumer.
+PREFETCH_DEPTH = 4
+
+# Marks the end of the batches in prefetch_batches' queue.
+END_OF_BATCHES = None
+
+
+def tokenize_batch(input_string: str) -> TokenBatch:
+    return TokenBatch.from_matches(TOKEN_PATTERN.findall(input_string))
+
+
+def gerber_tokenizer(input_string: str) -> Iterator[Token]:
+    return iter(tokenize_batch(input_string))
+
+
+def stream_batches(
+    stream: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[TokenBatch]:
+    # Tokenize a Gerber file incrementally so memory use doesn't depend on file size.
+    # Everything after the last '*' of a chunk is carried over to the next chunk because
+    # the token it contains may not be complete yet. The pieces carried over are only
+    # joined once a '*' ends them, so input without one isn't copied again and again.
+    pieces = []
+    while chunk := stream.read(chunk_size):
+        split = chunk.rfind(BLOCK_DELIMITER) + 1
+        if split == 0:
+            pieces.append(chunk)
+            continue
+        pieces.append(chunk[:split])
+        yield tokenize_batch("".join(pieces))
+        pieces = [chunk[split:]]
+    yield tokenize_batch("".join(pieces))
+
+
+def stream_tokenizer(
+    stream: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[Token]:
+    for batch in stream_batches(stream, chunk_size):
+        yield from batch
+
+
+def split_ranges(data: mmap.mmap | bytes, count: int) -> list[tuple[int, int]]:
+    # Split data into about count ranges that each end just after a '*'.
+    size = len(data)
+    range_size = max(MIN_RANGE_SIZE, size // max(count, 1))
+    ranges = []
+    start = 0
+    while start < size:
+        end = data.find(b"*", min(start + range_size, size) - 1)
+        end = size if end < 0 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def tokenize_range(file_name: str, start: int, end: int) -> TokenBatch:
+    # Runs in a worker process, so it maps the file itself rather than being sent the
+    # data.
+    with open(file_name, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with data:
+        return tokenize_batch(data[start:end].decode("ascii"))
+
+
+def parallel_batches(
+    file_name: str, workers: int | None = None
+) -> Iterator[TokenBatch]:
+    # Tokenize a memory-mapped file in a pool of worker processes. Ranges are split at
+    # '*' so no token is cut in half, and the results are yielded in file order. Only a
+    # few ranges per worker are in flight at a time so memory use stays bounded.
+    workers = workers or os.cpu_count() or 1
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            ranges = split_ranges(data, workers * RANGES_PER_WORKER)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for start, end in ranges:
+                pending.append(executor.submit(tokenize_range, file_name, start, end))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # The consumer may stop early, e.g. at M0.
+            for future in pending:
+                future.cancel()
+
+
+def parallel_tokenizer(file_name: str, workers: int | None = None) -> Iterator[Token]:
+    for batch in parallel_batches(file_name, workers):
+        yield from batch
+
+
+def prefetch_batches(
+    batches: Generator[TokenBatch, None, None], depth: int = PREFETCH_DEPTH
+) -> Iterator[TokenBatch]:
+    # Read and tokenize in a background thread while the consumer works on earlier
+    # batches. At most depth batches wait in the queue, so memory use stays bounded
+    # when the consumer is the slower stage.
+    ready = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Wait for room in the queue unless the consumer has stopped.
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if not put(batch):
+                    return
+        finally:
+            # Also sent after an error, which the consumer then takes from the future.
+            put(END_OF_BATCHES)
+            batches.close()
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    producer = executor.submit(produce)
+    try:
+        while (item := ready.get()) is not END_OF_BATCHES:
+            yield item
+        producer.result()
+    finally:
+        # The consumer may stop early, e.g. at M0.
+        stop.set()
+        executor.shutdown()
@@ -0,0 +1,110 @@
+import json
+import sys
+from array import array
+from typing import Iterator
+
+from backend import Backend
+from path_buffer import PathBuffer
+from point import Point, Tool
+
+# Kinds of toolpath records. For each kind, the record's two values are:
+PATH = 0  # tool number, number of vertices
+DRILL = 1  # x, y
+PATTERN = 2  # pattern number, unused
+FILE = 3  # file number, unused
+ORIGIN = 4  # x, y
+STOP = 5  # unused, unused (an M0 read through, see Gerber.through_stops)
+RETURN = 6  # x, y of the origin (M70 with the tool up)
+SPEED = 7  # unused, unused (M26 or O, resume normal speed)
+
+TOOLPATH_VERSION = 1
+
+
+class Toolpath:
+    # What a Gerber file does, without the tool offsets: the paths with their tool
+    # and vertices, drill hits, pattern and file numbers, origin changes, returns to
+    # the origin and speed changes, in the order they happen. Locations are in counts. A toolpath can be saved, loaded
+    # and rendered with any offsets without reading the Gerber file again.
+    kinds: array
+    first: array
+    second: array
+    # Vertices of all paths, one path after another.
+    xs: array
+    ys: array
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.first = array("q")
+        self.second = array("q")
+        self.xs = array("q")
+        self.ys = array("q")
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def add(self, kind: int, first: int, second: int = 0) -> None:
+        self.kinds.append(kind)
+        self.first.append(first)
+        self.second.append(second)
+
+    def add_path(self, tool: Tool, path: PathBuffer) -> None:
+        self.add(PATH, tool.value, len(path))
+        self.xs.extend(path.xs)
+        self.ys.extend(path.ys)
+
+    def records(self) -> Iterator[tuple[int, int, int, PathBuffer | None]]:
+        # Yield (kind, first, second, path) for every record. path is only set for
+        # paths.
+        vertex = 0
+        for kind, first, second in zip(self.kinds, self.first, self.second):
+            path = None
+            if kind == PATH:
+                path = PathBuffer(
+                    self.xs[vertex : vertex + second], self.ys[vertex : vertex + second]
+                )
+                vertex += second
+            yield kind, first, second, path
+
+    def render(self, backend: Backend, offsets: list[Point]) -> None:
+        # Plot the toolpath with the given mark, cut and drill offsets. This makes the
+        # same calls to backend that Gerber makes when it reads the file.
+        for kind, first, second, path in self.records():
+            if kind == PATH:
+                backend.plot_path(Tool(first), path.translated(offsets[first]))
+            elif kind == DRILL:
+                backend.plot_drill(Point(first, second) + offsets[Tool.DRILL.value])
+            elif kind in (PATTERN, STOP):
+                backend.end_pattern()
+        backend.finish()
+
+    def arrays(self) -> list[array]:
+        return [self.kinds, self.first, self.second, self.xs, self.ys]
+
+    def save(self, file_name: str) -> None:
+        # A JSON header line followed by the arrays as little endian binary.
+        header = {
+            "version": TOOLPATH_VERSION,
+            "records": len(self.kinds),
+            "vertices": len(self.xs),
+        }
+        with open(file_name, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for data in self.arrays():
+                if sys.byteorder == "big":
+                    data = array(data.typecode, data)
+                    data.byteswap()
+                data.tofile(f)
+
+    @staticmethod
+    def load(file_name: str) -> "Toolpath":
+        toolpath = Toolpath()
+        with open(file_name, "rb") as f:
+            header = json.loads(f.readline())
+            if header["version"] != TOOLPATH_VERSION:
+                raise ValueError(f"{file_name} has an unknown toolpath version.")
+            sizes = [header["records"]] * 3 + [header["vertices"]] * 2
+            for data, size in zip(toolpath.arrays(), sizes):
+                data.fromfile(f, size)
+                if sys.byteorder == "big":
+                    data.byteswap()
+        return toolpath
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import FILE_ERRORS
+from converter import ConversionOptions
+from patterns import PatternBlock, convert_blocks, split_patterns, write_index
+
+# Seconds between checks of the watched files.
+POLL_INTERVAL = 0.5
+
+
+def ignore_interrupts() -> None:
+    # Runs in each worker process. Ctrl-C reaches the workers as well as the
+    # parent, and only the parent should handle it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def block_digest(data: bytes, block: PatternBlock) -> str:
+    # Hash what the output of a pattern depends on: its commands and the state the
+    # patterns before it leave.
+    digest = hashlib.sha256(memoryview(data)[block.start : block.end])
+    digest.update(repr((block.units, block.origin, block.location)).encode())
+    return digest.hexdigest()
+
+
+class PatternWatcher:
+    # Keeps the pattern outputs of a file, as written by --patterns, up to date with
+    # the file. Each update converts only the patterns that changed since the last
+    # one, including patterns added after the last M0, and removes the outputs of
+    # patterns that are gone.
+    file_name: str
+    options: ConversionOptions
+    workers: int | None
+    executor: ProcessPoolExecutor | None
+    # Size and modification time of the file when it was last updated.
+    signature: tuple[int, int] | None
+    # The digest and output file names of each converted pattern by block number.
+    digests: dict[int, str]
+    output_names: dict[int, list[str]]
+
+    def __init__(
+        self,
+        file_name: str,
+        options: ConversionOptions,
+        workers: int | None = None,
+        executor: ProcessPoolExecutor | None = None,
+    ):
+        self.file_name = file_name
+        self.options = options
+        self.workers = workers
+        self.executor = executor
+        self.signature = None
+        self.digests = {}
+        self.output_names = {}
+
+    def current_signature(self) -> tuple[int, int] | None:
+        try:
+            status = os.stat(self.file_name)
+        except FileNotFoundError:
+            return None
+        return status.st_size, status.st_mtime_ns
+
+    def changed(self) -> bool:
+        signature = self.current_signature()
+        return signature is not None and signature != self.signature
+
+    def update(self) -> list[PatternBlock]:
+        # Convert the patterns that changed and rewrite the index. Return the
+        # patterns that were converted.
+        self.signature = self.current_signature()
+        with open(self.file_name, "rb") as f:
+            data = f.read()
+        blocks = split_patterns(self.file_name, self.options)
+
+        digests = {block.number: block_digest(data, block) for block in blocks}
+        changed = [
+            block
+            for block in blocks
+            if self.digests.get(block.number) != digests[block.number]
+        ]
+        for block, names in zip(
+            changed,
+            convert_blocks(
+                self.file_name, changed, self.options, self.workers, self.executor
+            ),
+        ):
+            self.digests[block.number] = digests[block.number]
+            self.output_names[block.number] = names
+
+        for number in list(self.output_names):
+            if number > len(blocks):
+                for name in self.output_names.pop(number):
+                    if os.path.exists(name):
+                        os.remove(name)
+                del self.digests[number]
+
+        write_index(
+            self.file_name,
+            blocks,
+            [self.output_names[block.number] for block in blocks],
+        )
+        return changed
+
+
+def watch_files(
+    watchers: list[PatternWatcher], interval: float, logger: logging.Logger
+) -> None:
+    # Update each watcher whose file changed, every interval seconds, forever.
+    while True:
+        for watcher in watchers:
+            if not watcher.changed():
+                continue
+            start = time.perf_counter()
+            try:
+                changed = watcher.update()
+            except FILE_ERRORS as e:
+                logger.error("%s: %s: %s", watcher.file_name, type(e).__name__, e)
+                continue
+            logger.info(
+                "%s: converted %d of %d patterns in %.2fs",
+                watcher.file_name,
+                len(changed),
+                len(watcher.digests),
+                time.perf_counter() - start,
+            )
+        time.sleep(interval)
+
+
+def watch(
+    file_names: list[str],
+    options: ConversionOptions,
+    workers: int | None = None,
+    interval: float = POLL_INTERVAL,
+) -> None:
+    # Convert the patterns of each file and then keep converting the ones that
+    # change, checking the files every interval seconds, until interrupted. Errors,
+    # such as a file read while it was half written, are logged and the file is
+    # tried again when it next changes. On interrupt, conversions that haven't
+    # started are cancelled before the KeyboardInterrupt is raised.
+    logger = logging.getLogger(__name__)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=ignore_interrupts
+    ) as executor:
+        watchers = [
+            PatternWatcher(file_name, options, workers, executor)
+            for file_name in file_names
+        ]
+        try:
+            watch_files(watchers, interval, logger)
+        except KeyboardInterrupt:
+            executor.shutdown(cancel_futures=True)
+            raise